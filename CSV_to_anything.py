@@ -4,38 +4,293 @@
 # To run this script, you will need to install the following libraries:
 # pip install Flask requests beautifulsoup4 pandas openpyxl reportlab
 #
+# Optional extras that make things faster when installed:
+# pip install lxml
+#
 # To launch the application, follow these steps in your terminal:
 # 1. set FLASK_APP=Data_Grab.py (Windows) OR export FLASK_APP=Data_Grab.py (macOS/Linux)
 # 2. flask run
 
-from flask import Flask, render_template_string, request, jsonify, send_file
+from flask import Flask, render_template_string, request, jsonify, Response
+from werkzeug.wsgi import wrap_file
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
 import io
+import codecs
 import datetime
-import pandas as pd
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from reportlab.lib import colors
 import json
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+from email.utils import parsedate_to_datetime
 import uuid
 import threading
 import time
-from collections import deque
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import math
 import os
 import re
+import importlib.util
+import itertools
+import functools
+import bisect
+import cProfile
+import pstats
+import tracemalloc
+import queue
+import mmap
+import tempfile
+import zipfile
+import shutil
+import stat
+import atexit
+import hashlib
+import sqlite3
+import pickle
+import zlib
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 
 app = Flask(__name__)
 
-# A simple in-memory store to hold generated files and task status.
-# This simulates a background task and is a good first step towards
-# a more robust, asynchronous architecture.
+# A simple in-memory store to hold task status. Generated files live in
+# file_store, a FileStore created further down once the class is defined.
 task_status = {}
-file_store = {}
 
-# A simple lock for thread-safe access to file_store.
-file_store_lock = threading.Lock()
+# Rows extracted so far by each scrape task, as ResultBuffers, so clients can
+# page through results while the crawl is still running.
+task_results = {}
+
+# A simple lock for thread-safe access to file_store. It is re-entrant so
+# callers can hold it around file_store operations that also take it.
+file_store_lock = threading.RLock()
+
+# Crawl concurrency settings. Scraping is I/O bound, so pages are fetched on
+# a bounded thread pool; the per-host cap keeps a single site from getting
+# every worker at once. Both can be overridden per job from /start-scrape.
+SCRAPE_MAX_CONCURRENCY = int(os.environ.get('SCRAPE_MAX_CONCURRENCY', '16'))
+SCRAPE_PER_HOST_CONCURRENCY = int(os.environ.get('SCRAPE_PER_HOST_CONCURRENCY', '4'))
+
+# Politeness towards the sites being crawled. With SCRAPE_RESPECT_ROBOTS each
+# site's robots.txt is read once per ROBOTS_TTL seconds, disallowed pages are
+# skipped and its Crawl-delay is honoured. Only the first ROBOTS_MAX_BYTES of a
+# robots.txt are downloaded and parsed (RFC 9309 asks for at least 500 KiB).
+# Every host starts at
+# HOST_INITIAL_CONCURRENCY requests in flight, adapted AIMD-style up to the
+# per-host cap: one more while responses stay fast, half as many after a 429
+# or 503 or when latency climbs past HOST_LATENCY_FACTOR times the host's best.
+# Throttled pages are retried up to SCRAPE_MAX_RETRIES times, after the
+# Retry-After the host asked for or an exponential backoff, capped at
+# HOST_MAX_BACKOFF seconds. Requests identify as SCRAPE_USER_AGENT.
+SCRAPE_USER_AGENT = os.environ.get('SCRAPE_USER_AGENT') or requests.utils.default_user_agent()
+SCRAPE_RESPECT_ROBOTS = os.environ.get('SCRAPE_RESPECT_ROBOTS', '1') == '1'
+ROBOTS_TTL = int(os.environ.get('ROBOTS_TTL', '3600'))
+ROBOTS_MAX_BYTES = int(os.environ.get('ROBOTS_MAX_BYTES', str(500 * 1024)))
+HOST_INITIAL_CONCURRENCY = int(os.environ.get('HOST_INITIAL_CONCURRENCY', '2'))
+HOST_LATENCY_FACTOR = float(os.environ.get('HOST_LATENCY_FACTOR', '3'))
+HOST_MAX_BACKOFF = int(os.environ.get('HOST_MAX_BACKOFF', '300'))
+SCRAPE_MAX_RETRIES = int(os.environ.get('SCRAPE_MAX_RETRIES', '3'))
+
+# Keep-alive connection pool settings shared by every scrape job.
+# HTTP_POOL_HOSTS is how many per-host pools are kept around, and
+# HTTP_POOL_MAXSIZE is how many idle connections each host pool holds.
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', '64'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '32'))
+
+# How a crawl remembers the URLs it has already queued. 'exact' keeps the
+# canonical URLs themselves; 'digest' keeps 8-byte hashes of them; 'bloom' uses
+# a Bloom filter sized for SCRAPE_BLOOM_CAPACITY URLs, which is the most
+# compact but may skip a page with probability SCRAPE_BLOOM_ERROR_RATE.
+SCRAPE_SEEN_SET = os.environ.get('SCRAPE_SEEN_SET', 'exact')
+SCRAPE_BLOOM_CAPACITY = int(os.environ.get('SCRAPE_BLOOM_CAPACITY', '1000000'))
+SCRAPE_BLOOM_ERROR_RATE = float(os.environ.get('SCRAPE_BLOOM_ERROR_RATE', '0.001'))
+
+# HTML parser backend for BeautifulSoup: 'lxml', 'html.parser', or 'auto' to
+# use lxml when it is installed (pip install lxml) and html.parser otherwise.
+# With SCRAPE_PARSE_ONLY enabled only the requested tags (plus anchors when
+# links still need following) are built into the tree, not the whole page.
+# Jobs extracting by CSS selector always parse the whole page.
+SCRAPE_HTML_PARSER = os.environ.get('SCRAPE_HTML_PARSER', 'auto')
+SCRAPE_PARSE_ONLY = os.environ.get('SCRAPE_PARSE_ONLY', '1') == '1'
+
+# Pages are downloaded as a stream so only HTML is read. Responses whose
+# Content-Type is not one of SCRAPE_HTML_TYPES are dropped once the headers
+# arrive, and pages over SCRAPE_MAX_PAGE_BYTES, going by their Content-Length
+# or by how much has been read so far, are abandoned with an error row. Links
+# whose path ends in one of SCRAPE_SKIP_EXTENSIONS are never queued; set it to
+# an empty string to follow every link.
+SCRAPE_HTML_TYPES = frozenset(
+    t.strip().lower() for t in os.environ.get('SCRAPE_HTML_TYPES', 'text/html,application/xhtml+xml').split(',')
+    if t.strip())
+SCRAPE_MAX_PAGE_BYTES = int(os.environ.get('SCRAPE_MAX_PAGE_BYTES', str(10 * 1024 * 1024)))
+SCRAPE_SKIP_EXTENSIONS = frozenset(
+    '.' + ext.strip().lower().lstrip('.') for ext in os.environ.get(
+        'SCRAPE_SKIP_EXTENSIONS',
+        '7z,avi,bmp,bz2,css,csv,dmg,doc,docx,exe,flac,gif,gz,ico,iso,jpeg,jpg,js,json,m4a,mkv,mov,'
+        'mp3,mp4,mpeg,mpg,ogg,otf,pdf,png,ppt,pptx,rar,svg,tar,tgz,tif,tiff,ttf,wav,webm,webp,'
+        'woff,woff2,xls,xlsx,xz,zip').split(',')
+    if ext.strip())
+
+# Per-user directory for the files the app keeps between runs:
+# $XDG_CACHE_HOME/dataflow or ~/.cache/dataflow, or %LOCALAPPDATA%\dataflow on
+# Windows. It is created readable by its owner only.
+APP_DATA_DIR = os.environ.get('APP_DATA_DIR') or os.path.join(
+    os.environ.get('LOCALAPPDATA' if os.name == 'nt' else 'XDG_CACHE_HOME')
+    or os.path.join(os.path.expanduser('~'), '.cache'), 'dataflow')
+
+# On-disk HTTP cache for the scraper, shared by every job. Entries younger than
+# HTTP_CACHE_TTL seconds are used without a request; older ones are revalidated
+# with If-None-Match/If-Modified-Since. With HTTP_CACHE_REUSE_EXTRACTION the rows
+# extracted from a page are kept too and reused when it has not changed.
+# Set HTTP_CACHE_PATH to an empty string to turn the cache off.
+HTTP_CACHE_PATH = os.environ.get('HTTP_CACHE_PATH', os.path.join(APP_DATA_DIR, 'http-cache.sqlite3'))
+HTTP_CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', '0'))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+HTTP_CACHE_REUSE_EXTRACTION = os.environ.get('HTTP_CACHE_REUSE_EXTRACTION', '1') == '1'
+
+# Scrape results are kept column by column; every RESULT_SPILL_ROWS rows the
+# in-memory part is written out to a temp file segment. /results serves at
+# most RESULTS_PAGE_MAX rows per request.
+RESULT_SPILL_ROWS = int(os.environ.get('RESULT_SPILL_ROWS', '100000'))
+RESULTS_PAGE_MAX = int(os.environ.get('RESULTS_PAGE_MAX', '1000'))
+
+# Scrapes save a checkpoint every SCRAPE_CHECKPOINT_INTERVAL seconds (0 turns
+# this off) in a directory per task under SCRAPE_CHECKPOINT_DIR: the pages still
+# to fetch, the seen-set and the rows extracted so far. POST /resume/<task_id>
+# continues a crawl whose process died, or that failed or was cancelled, from
+# its last checkpoint without fetching its finished pages again. Checkpoints
+# are removed when a crawl finishes, or SCRAPE_CHECKPOINT_TTL seconds after
+# they were last saved if the crawl is never resumed. Checkpoints hold pickles,
+# so SCRAPE_CHECKPOINT_DIR must only be writable by the user running the app;
+# none are read from a directory anyone else can write to.
+SCRAPE_CHECKPOINT_INTERVAL = float(os.environ.get('SCRAPE_CHECKPOINT_INTERVAL', '60'))
+SCRAPE_CHECKPOINT_DIR = os.environ.get('SCRAPE_CHECKPOINT_DIR', os.path.join(APP_DATA_DIR, 'checkpoints'))
+SCRAPE_CHECKPOINT_TTL = int(os.environ.get('SCRAPE_CHECKPOINT_TTL', str(7 * 24 * 3600)))
+
+# Server-Sent Events progress stream. A comment line is sent every
+# SSE_HEARTBEAT_SECONDS without changes to keep proxies from closing the
+# connection, and progress events are sent at most every SSE_MIN_INTERVAL.
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MIN_INTERVAL = float(os.environ.get('SSE_MIN_INTERVAL', '0.25'))
+
+# Background job settings. JOB_WORKERS jobs run at once, up to JOB_QUEUE_MAX
+# more wait in the queue (further submissions get a 429), and finished task
+# statuses are forgotten TASK_STATUS_TTL seconds after the job ends.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', '100'))
+TASK_STATUS_TTL = int(os.environ.get('TASK_STATUS_TTL', '3600'))
+
+# Generated file storage. Artifacts of FILE_STORE_SPILL_BYTES or more are
+# written to temp files under FILE_STORE_DIR and served via mmap; the rest
+# stay in memory until FILE_STORE_MAX_MEMORY_BYTES is reached, after which the
+# least recently used ones are spilled too. Once FILE_STORE_MAX_DISK_BYTES is
+# exceeded the least recently used spilled files are dropped, and every file
+# expires FILE_STORE_TTL seconds after it was created.
+FILE_STORE_MAX_MEMORY_BYTES = int(os.environ.get('FILE_STORE_MAX_MEMORY_BYTES', str(256 * 1024 * 1024)))
+FILE_STORE_MAX_DISK_BYTES = int(os.environ.get('FILE_STORE_MAX_DISK_BYTES', str(4 * 1024 * 1024 * 1024)))
+FILE_STORE_SPILL_BYTES = int(os.environ.get('FILE_STORE_SPILL_BYTES', str(8 * 1024 * 1024)))
+FILE_STORE_TTL = int(os.environ.get('FILE_STORE_TTL', '3600'))
+FILE_STORE_DIR = os.environ.get('FILE_STORE_DIR') or None
+
+# Where task statuses and the metadata of generated files are shared between
+# worker processes, so /status, /events, /cancel and /download work whichever
+# worker a request lands on. 'memory' keeps them in the process running the
+# job, which is enough for a single worker. 'sqlite:///path/state.sqlite3'
+# shares them between the processes of one host; 'redis://host:6379/0' shares
+# them between hosts (pip install redis). With a shared backend every generated
+# file is written to FILE_STORE_DIR, which must then be storage all workers
+# see. Progress is saved at most every STATE_PROGRESS_INTERVAL seconds, and
+# workers poll the backend every STATE_POLL_INTERVAL seconds for the progress
+# of other workers' jobs and for cancellations of their own.
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+STATE_PROGRESS_INTERVAL = float(os.environ.get('STATE_PROGRESS_INTERVAL', '0.5'))
+STATE_POLL_INTERVAL = float(os.environ.get('STATE_POLL_INTERVAL', '1'))
+
+# /convert reads uploads CONVERT_CHUNK_ROWS rows at a time, after a first pass
+# over their numeric columns so every chunk gets the types a whole-file read
+# would. Formats in STREAMING_FORMATS are written out chunk by chunk, so memory
+# stays bounded no matter how large the upload is. OUTPUT_FORMATS are all the formats offered;
+# the columnar COLUMNAR_FORMATS are only offered when pyarrow is installed.
+CONVERT_CHUNK_ROWS = int(os.environ.get('CONVERT_CHUNK_ROWS', '50000'))
+STREAMING_FORMATS = ('csv', 'json', 'ndjson', 'html', 'xlsx')
+COLUMNAR_FORMATS = ('parquet', 'feather')
+OUTPUT_FORMATS = ('csv', 'xlsx', 'pdf', 'json', 'ndjson', 'html') + (
+    COLUMNAR_FORMATS if importlib.util.find_spec('pyarrow') is not None else ())
+
+# How uploaded CSVs are read. CSV_ENCODING names their codec; with 'auto' it
+# is detected from the first CSV_SNIFF_BYTES bytes: a byte order mark, else
+# UTF-8 if they decode as such, else charset_normalizer's best guess. With
+# CSV_ENGINE 'pyarrow' uploads parsed whole are read by pyarrow's multithreaded
+# parser (pip install pyarrow), which unlike the default 'c' parser also
+# recognises dates; chunked reads always use the C parser. CSV_OPTIMIZE_DTYPES
+# shrinks uploads parsed whole, which are cached and rendered as one table:
+# integer columns are downcast to the smallest type that holds them, and text
+# columns with at most CSV_CATEGORY_MAX_RATIO distinct values per row become
+# categoricals. Floats keep their precision, so no output changes.
+CSV_ENCODING = os.environ.get('CSV_ENCODING', 'auto')
+CSV_SNIFF_BYTES = int(os.environ.get('CSV_SNIFF_BYTES', str(64 * 1024)))
+CSV_ENGINE = os.environ.get('CSV_ENGINE', 'c')
+CSV_OPTIMIZE_DTYPES = os.environ.get('CSV_OPTIMIZE_DTYPES', '1') == '1'
+CSV_CATEGORY_MAX_RATIO = float(os.environ.get('CSV_CATEGORY_MAX_RATIO', '0.5'))
+
+# /convert-batch accepts up to CONVERT_BATCH_MAX_FILES uploads per request.
+# Formats that are already compressed are stored in the ZIP as they are.
+CONVERT_BATCH_MAX_FILES = int(os.environ.get('CONVERT_BATCH_MAX_FILES', '20'))
+ZIP_STORED_FORMATS = ('xlsx', 'pdf', 'parquet', 'feather')
+
+# Conversion cache. Results are remembered per (upload hash, format) for up to
+# CONVERT_CACHE_MAX_RESULTS conversions, and parsed DataFrames of uploads up to
+# CONVERT_CACHE_MAX_UPLOAD_BYTES are pickled to temp files, within
+# CONVERT_CACHE_MAX_FRAME_BYTES on disk, so converting the same file to another
+# format skips read_csv.
+CONVERT_CACHE_MAX_RESULTS = int(os.environ.get('CONVERT_CACHE_MAX_RESULTS', '1024'))
+CONVERT_CACHE_MAX_FRAME_BYTES = int(os.environ.get('CONVERT_CACHE_MAX_FRAME_BYTES', str(256 * 1024 * 1024)))
+CONVERT_CACHE_MAX_UPLOAD_BYTES = int(os.environ.get('CONVERT_CACHE_MAX_UPLOAD_BYTES', str(32 * 1024 * 1024)))
+
+# Excel's hard limit on rows per worksheet, header row included. Larger
+# results continue on Sheet2, Sheet3 and so on.
+XLSX_MAX_ROWS_PER_SHEET = 1048576
+
+# PDF rendering settings. Tables are drawn one page at a time with the header
+# repeated on every page; column widths are fixed from a sample of the data and
+# longer cell text is truncated to fit. With PDF_PARALLEL_WORKERS > 0 (and pypdf
+# installed) tables of PDF_PARALLEL_MIN_ROWS rows or more are rendered in page
+# ranges on worker processes and merged. This only applies with RENDER_WORKERS=0;
+# inside a render worker the PDF is drawn in that one process.
+PDF_FONT_SIZE = 8
+PDF_ROW_HEIGHT = 14
+PDF_HEADER_HEIGHT = 24
+PDF_MARGIN = 36
+PDF_PARALLEL_WORKERS = int(os.environ.get('PDF_PARALLEL_WORKERS', '0'))
+PDF_PARALLEL_MIN_ROWS = int(os.environ.get('PDF_PARALLEL_MIN_ROWS', '50000'))
+
+# Output files of /convert and of finished scrapes are rendered on a pool of
+# RENDER_WORKERS spawned processes, so CPU-heavy formats never hold the web
+# server's GIL; 0 renders in the calling thread instead. Up to RENDER_QUEUE_MAX
+# conversions wait for a free worker before /convert answers with a 429.
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '2'))
+RENDER_QUEUE_MAX = int(os.environ.get('RENDER_QUEUE_MAX', '50'))
+
+# Instrumentation served on /metrics. Stage and request latencies are counted
+# in histogram buckets of METRICS_BUCKETS seconds. Jobs started with "profile"
+# also get a cProfile and tracemalloc report listing the PROFILE_TOP biggest
+# entries; tracemalloc slows the whole process down while a profile runs.
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '40'))
+
+# pandas, openpyxl, reportlab and BeautifulSoup are imported the first time a
+# conversion or scrape needs them, so a process that only answers /status or
+# /download never loads them. WARM_UP_IMPORTS=1 imports them all at startup
+# instead, and in every render worker as it starts; with a pre-fork server
+# (e.g. gunicorn --preload) the master does it once and the forked workers
+# share the loaded modules. Servers can also call warm_up() from their own hook.
+WARM_UP_IMPORTS = os.environ.get('WARM_UP_IMPORTS', '0') == '1'
+WARM_UP_MODULES = ('pandas', 'openpyxl', 'openpyxl.cell', 'openpyxl.styles', 'reportlab.lib.colors',
+                   'reportlab.lib.pagesizes', 'reportlab.pdfgen.canvas', 'reportlab.platypus', 'bs4')
 
 # The HTML for the user interface, including two distinct forms for
 # scraping and file conversion.
@@ -217,13 +472,14 @@ HTML_TEMPLATE = """
             <p>Enter a URL to scrape all links and download them in your desired format.</p>
             <form id="scraper-form" class="space-y-4">
                 <input type="text" id="url-input" placeholder="https://example.com" required>
-                <input type="text" id="filter-input" placeholder="Optional: Filter links by a keyword">
+                <input type="text" id="filter-input" placeholder="Optional: Filter by keywords, separated by commas">
                 <select id="tag-select">
                     <option value="a">Links (&lt;a&gt;)</option>
                     <option value="img">Images (&lt;img&gt;)</option>
                     <option value="h1,h2,h3,h4,h5,h6">Headings (&lt;h1-h6&gt;)</option>
                     <option value="p">Paragraphs (&lt;p&gt;)</option>
                 </select>
+                <input type="text" id="selector-input" placeholder="Optional: CSS selector instead, e.g. div.price or a[href$='.pdf']">
                 <div>
                     <label for="depth-input" class="block text-sm font-medium text-gray-300 text-left mb-1">Scrape Depth</label>
                     <p class="text-xs text-gray-400 mb-2 text-left">
@@ -238,7 +494,12 @@ HTML_TEMPLATE = """
                     <option value="xlsx">Excel (xlsx)</option>
                     <option value="pdf">PDF</option>
                     <option value="json">JSON</option>
+                    <option value="ndjson">NDJSON (one record per line)</option>
                     <option value="html">HTML Table</option>
+                    {% if 'parquet' in output_formats %}
+                    <option value="parquet">Parquet</option>
+                    <option value="feather">Feather (Arrow IPC)</option>
+                    {% endif %}
                 </select>
                 <button type="submit" id="scrape-button">Scrape & Download</button>
             </form>
@@ -250,15 +511,20 @@ HTML_TEMPLATE = """
 
         <div class="card">
             <h2>File Converter</h2>
-            <p>Upload a CSV file and convert it to your desired format.</p>
+            <p>Upload CSV files and convert them to one or more formats. Several files or formats come back as one ZIP.</p>
             <form id="converter-form" enctype="multipart/form-data" class="space-y-4">
-                <input type="file" id="file-input" name="file" accept=".csv" required>
-                <label for="file-input" class="file-upload-label">Choose a CSV file...</label>
-                <select id="convert-format-select">
-                    <option value="xlsx">Excel (xlsx)</option>
+                <input type="file" id="file-input" name="file" accept=".csv" multiple required>
+                <label for="file-input" class="file-upload-label">Choose CSV files...</label>
+                <select id="convert-format-select" multiple title="Hold Ctrl or Cmd to pick several formats">
+                    <option value="xlsx" selected>Excel (xlsx)</option>
                     <option value="pdf">PDF</option>
                     <option value="json">JSON</option>
+                    <option value="ndjson">NDJSON (one record per line)</option>
                     <option value="html">HTML Table</option>
+                    {% if 'parquet' in output_formats %}
+                    <option value="parquet">Parquet</option>
+                    <option value="feather">Feather (Arrow IPC)</option>
+                    {% endif %}
                 </select>
                 <button type="submit" id="convert-button">Convert & Download</button>
             </form>
@@ -292,6 +558,45 @@ HTML_TEMPLATE = """
             messageBox.style.display = 'none';
         });
 
+        // Follows a task's status. Uses Server-Sent Events so updates arrive only
+        // when progress changes, and falls back to polling /status in browsers
+        // without EventSource. onStatus returns true once the task has finished.
+        function watchTask(taskId, onStatus, onError) {
+            if (window.EventSource) {
+                const source = new EventSource('/events/' + taskId);
+                source.onmessage = event => {
+                    if (onStatus(JSON.parse(event.data))) {
+                        source.close();
+                    }
+                };
+                source.addEventListener('not_found', () => {
+                    source.close();
+                    onError(new Error('The task no longer exists.'));
+                });
+                source.onerror = () => {
+                    // The browser reconnects by itself unless the stream is gone for good.
+                    if (source.readyState === EventSource.CLOSED) {
+                        onError(new Error('Lost connection to the server.'));
+                    }
+                };
+                return;
+            }
+
+            const pollInterval = setInterval(() => {
+                fetch('/status/' + taskId)
+                    .then(res => res.json())
+                    .then(statusData => {
+                        if (onStatus(statusData)) {
+                            clearInterval(pollInterval);
+                        }
+                    })
+                    .catch(error => {
+                        clearInterval(pollInterval);
+                        onError(error);
+                    });
+            }, 1000); // Poll every 1 seconds
+        }
+
         // Set up the form submission for the web scraper
         document.getElementById('scraper-form').addEventListener('submit', function(event) {
             event.preventDefault();
@@ -299,7 +604,9 @@ HTML_TEMPLATE = """
             const url = document.getElementById('url-input').value;
             const tag = document.getElementById('tag-select').value;
             const depth = document.getElementById('depth-input').value;
-            const filter_keyword = document.getElementById('filter-input').value;
+            const filter_keywords = document.getElementById('filter-input').value
+                .split(',').map(keyword => keyword.trim()).filter(keyword => keyword);
+            const selector = document.getElementById('selector-input').value.trim();
             const format = document.getElementById('scrape-format-select').value;
             const statusDiv = document.getElementById('scrape-status');
             const submitButton = document.getElementById('scrape-button');
@@ -316,7 +623,8 @@ HTML_TEMPLATE = """
             fetch('/start-scrape', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ url: url, format: format, tag: tag, filter_keyword: filter_keyword, depth: depth })
+                body: JSON.stringify({ url: url, format: format, tag: tag, filter_keywords: filter_keywords,
+                                       selector: selector, depth: depth })
             })
             .then(response => {
                 if (response.ok) {
@@ -326,53 +634,50 @@ HTML_TEMPLATE = """
                 }
             })
             .then(data => {
-                // Polling for the task status
+                // Follow the task status as the server pushes changes
                 const taskId = data.task_id;
-                const pollInterval = setInterval(() => {
-                    fetch('/status/' + taskId)
-                        .then(res => res.json())
-                        .then(statusData => {
-                            if (statusData.status === 'completed') {
-                                clearInterval(pollInterval);
-                                statusDiv.innerHTML = `
-                                    <strong>Scrape complete!</strong><br>
-                                    Total Items Found: ${statusData.summary.total_items}
-                                `;
-                                statusDiv.className = 'status success';
-
-                                // Trigger the download
-                                const link = document.createElement('a');
-                                link.href = '/download/' + statusData.file_id;
-                                link.download = statusData.filename;
-                                document.body.appendChild(link);
-                                link.click();
-                                document.body.removeChild(link);
-                                submitButton.disabled = false;
-                                progressBarContainer.style.display = 'none';
-
-                            } else if (statusData.status === 'failed') {
-                                clearInterval(pollInterval);
-                                showMessage('Error: ' + statusData.error);
-                                statusDiv.textContent = '';
-                                statusDiv.className = 'status error';
-                                submitButton.disabled = false;
-                                progressBarContainer.style.display = 'none';
-                            } else if (statusData.status === 'in_progress') {
-                                // Update progress bar and text
-                                const progressPercentage = statusData.progress.percentage;
-                                progressBar.style.width = `${progressPercentage}%`;
-                                statusDiv.querySelector('.progress-info').textContent = statusData.progress.message;
-                            }
-                        })
-                        .catch(error => {
-                            clearInterval(pollInterval);
-                            showMessage('Error polling for status: ' + error.message);
-                            statusDiv.textContent = '';
-                            statusDiv.className = 'status error';
-                            submitButton.disabled = false;
-                            progressBarContainer.style.display = 'none';
-                        });
-                }, 1000); // Poll every 1 seconds
+                watchTask(taskId, statusData => {
+                    if (statusData.status === 'completed') {
+                        statusDiv.innerHTML = `
+                            <strong>Scrape complete!</strong><br>
+                            Total Items Found: ${statusData.summary.total_items}
+                        `;
+                        statusDiv.className = 'status success';
+
+                        // Trigger the download
+                        const link = document.createElement('a');
+                        link.href = '/download/' + statusData.file_id;
+                        link.download = statusData.filename;
+                        document.body.appendChild(link);
+                        link.click();
+                        document.body.removeChild(link);
+                        submitButton.disabled = false;
+                        progressBarContainer.style.display = 'none';
+                        return true;
+
+                    } else if (statusData.status === 'failed' || statusData.status === 'cancelled') {
+                        showMessage(statusData.status === 'cancelled' ? 'The scrape was cancelled.' : 'Error: ' + statusData.error);
+                        statusDiv.textContent = '';
+                        statusDiv.className = 'status error';
+                        submitButton.disabled = false;
+                        progressBarContainer.style.display = 'none';
+                        return true;
+                    } else if (statusData.status === 'queued') {
+                        statusDiv.querySelector('.progress-info').textContent = 'Waiting for a free worker...';
+                    } else if (statusData.status === 'in_progress') {
+                        // Update progress bar and text
+                        const progressPercentage = statusData.progress.percentage;
+                        progressBar.style.width = `${progressPercentage}%`;
+                        statusDiv.querySelector('.progress-info').textContent = statusData.progress.message;
+                    }
+                    return false;
+                }, error => {
+                    showMessage('Error following the scrape status: ' + error.message);
+                    statusDiv.textContent = '';
+                    statusDiv.className = 'status error';
+                    submitButton.disabled = false;
+                    progressBarContainer.style.display = 'none';
+                });
 
             })
             .catch(error => {
@@ -390,25 +695,36 @@ HTML_TEMPLATE = """
             event.preventDefault();
 
             const fileInput = document.getElementById('file-input');
-            const file = fileInput.files[0];
-            const format = document.getElementById('convert-format-select').value;
+            const files = Array.from(fileInput.files);
+            const formats = Array.from(document.getElementById('convert-format-select').selectedOptions, option => option.value);
             const statusDiv = document.getElementById('convert-status');
             const submitButton = document.getElementById('convert-button');
 
-            if (!file) {
+            if (files.length === 0) {
                 showMessage('Please select a file to upload.');
                 return;
             }
+            if (formats.length === 0) {
+                showMessage('Please select at least one format.');
+                return;
+            }
 
             statusDiv.innerHTML = '<div class="loader-container"><div class="loader"></div><div class="progress-info">Converting... Please wait.</div></div>';
             statusDiv.className = 'status loading';
             submitButton.disabled = true;
 
+            // Several files or formats are converted together and come back as one ZIP.
+            const batch = files.length > 1 || formats.length > 1;
             const formData = new FormData();
-            formData.append('file', file);
-            formData.append('format', format);
+            if (batch) {
+                files.forEach(file => formData.append('files', file));
+                formats.forEach(format => formData.append('formats', format));
+            } else {
+                formData.append('file', files[0]);
+                formData.append('format', formats[0]);
+            }
 
-            fetch('/convert', {
+            fetch(batch ? '/convert-batch' : '/convert', {
                 method: 'POST',
                 body: formData
             })
@@ -420,29 +736,59 @@ HTML_TEMPLATE = """
                 }
             })
             .then(data => {
-                 statusDiv.textContent = 'Conversion complete! Downloading file.';
-                 statusDiv.className = 'status success';
-
-                // Trigger the download
-                const link = document.createElement('a');
-                link.href = '/download/' + data.file_id;
-                link.download = data.filename;
-                document.body.appendChild(link);
-                link.click();
-                document.body.removeChild(link);
+                const finish = (fileId, filename) => {
+                    statusDiv.textContent = 'Conversion complete! Downloading file.';
+                    statusDiv.className = 'status success';
+
+                    // Trigger the download
+                    const link = document.createElement('a');
+                    link.href = '/download/' + fileId;
+                    link.download = filename;
+                    document.body.appendChild(link);
+                    link.click();
+                    document.body.removeChild(link);
+                    submitButton.disabled = false;
+                };
+                const fail = message => {
+                    showMessage(message);
+                    statusDiv.textContent = '';
+                    statusDiv.className = 'status error';
+                    submitButton.disabled = false;
+                };
+
+                // Repeat conversions come back right away; new ones run as a background job.
+                if (data.file_id) {
+                    finish(data.file_id, data.filename);
+                    return;
+                }
+                watchTask(data.task_id, statusData => {
+                    if (statusData.status === 'completed') {
+                        finish(statusData.file_id, statusData.filename);
+                        return true;
+                    } else if (statusData.status === 'failed' || statusData.status === 'cancelled') {
+                        fail(statusData.status === 'cancelled' ? 'The conversion was cancelled.' : 'Error: ' + statusData.error);
+                        return true;
+                    } else if (statusData.status === 'queued') {
+                        statusDiv.querySelector('.progress-info').textContent = 'Waiting for a free worker...';
+                    } else if (statusData.status === 'in_progress') {
+                        statusDiv.querySelector('.progress-info').textContent = statusData.progress.message;
+                    }
+                    return false;
+                }, error => fail('Error following the conversion status: ' + error.message));
             })
             .catch(error => {
                 showMessage('Error: ' + error.message);
                 statusDiv.textContent = '';
                 statusDiv.className = 'status error';
                 console.error('Operation failed:', error);
-            })
-            .finally(() => submitButton.disabled = false);
+                submitButton.disabled = false;
+            });
         });
 
         // Handle file input label
         document.getElementById('file-input').addEventListener('change', function(e) {
-            const fileName = e.target.files[0] ? e.target.files[0].name : "Choose a CSV file...";
+            const count = e.target.files.length;
+            const fileName = count > 1 ? `${count} files selected` : (count ? e.target.files[0].name : "Choose CSV files...");
             document.querySelector('.file-upload-label').textContent = fileName;
         });
     </script>
@@ -450,90 +796,9 @@ HTML_TEMPLATE = """
 </html>
 """
 
-
-# Function to sanitize filenames to prevent path traversal
-def sanitize_filename(filename):
-    """
-    Sanitizes a filename to prevent directory traversal attacks.
-    """
-    filename = os.path.basename(filename)
-    filename = re.sub(r'[^a-zA-Z0-9_.-]', '', filename)
-    return filename
-
-
-# The main route for the web page
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-
-# Helper function to convert a pandas DataFrame to the specified format and returns a file object
-def create_file_object(df, output_format):
-    """
-    Converts a pandas DataFrame to the specified format and returns a file-like object.
-    """
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename_base = f"output_{timestamp}"
-
-    try:
-        if output_format == 'csv':
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return {
-                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
-                "mimetype": 'text/csv',
-                "filename": f'{filename_base}.csv'
-            }
-
-        elif output_format == 'xlsx':
-            output = io.BytesIO()
-            df.to_excel(output, index=False)
-            output.seek(0)
-            return {
-                "file_obj": output,
-                "mimetype": 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                "filename": f'{filename_base}.xlsx'
-            }
-
-        elif output_format == 'pdf':
-            output = io.BytesIO()
-            doc = SimpleDocTemplate(output, pagesize=letter)
-
-            data = [df.columns.tolist()] + df.values.tolist()
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-            elements = [table]
-            doc.build(elements)
-
-            output.seek(0)
-            return {
-                "file_obj": output,
-                "mimetype": 'application/pdf',
-                "filename": f'{filename_base}.pdf'
-            }
-
-        elif output_format == 'json':
-            output = io.StringIO()
-            df.to_json(output, orient='records', indent=4)
-            output.seek(0)
-            return {
-                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
-                "mimetype": 'application/json',
-                "filename": f'{filename_base}.json'
-            }
-
-        elif output_format == 'html':
-            html_table = df.to_html(index=False, classes='table-auto', escape=False)
-            full_html = f"""
+# Page wrapper for the 'html' output format. The table goes in {html_table};
+# literal braces in the CSS are doubled for str.format.
+HTML_TABLE_PAGE = """
             <!DOCTYPE html>
             <html lang="en">
             <head>
@@ -559,240 +824,4007 @@ def create_file_object(df, output_format):
             </body>
             </html>
             """
-            output = io.StringIO()
-            output.write(full_html)
-            output.seek(0)
-            return {
-                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
-                "mimetype": 'text/html',
-                "filename": f'{filename_base}.html'
-            }
-        else:
-            return None
-    except Exception as e:
-        print(f"Error during file creation: {e}")
+
+
+# Function to sanitize filenames to prevent path traversal
+def sanitize_filename(filename):
+    """
+    Sanitizes a filename to prevent directory traversal attacks.
+    """
+    filename = os.path.basename(filename)
+    filename = re.sub(r'[^a-zA-Z0-9_.-]', '', filename)
+    return filename
+
+
+# Returns the bytes of a stored artifact as a read-only view, without copying.
+def artifact_buffer(file_obj):
+    """
+    Returns a read-only memoryview over a stored file object, which is either
+    a BytesIO held in memory or an mmap of a spilled temp file.
+    """
+    if isinstance(file_obj, mmap.mmap):
+        return memoryview(file_obj).toreadonly()
+    return file_obj.getbuffer().toreadonly()
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over a memoryview. Each read copies only
+    the chunk asked for, so streaming an artifact never duplicates all of it.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = buffer
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._buffer) if size is None or size < 0 else self._pos + size
+        chunk = bytes(self._buffer[self._pos:end])
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, b):
+        chunk = self._buffer[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._buffer.release()
+        super().close()
+
+
+class StateBackend:
+    """
+    Store for task statuses, cancellation requests and the metadata of
+    generated files that every worker process can reach, so any of them can
+    answer for a job another one runs.
+
+    This base class is the 'memory' backend, which shares nothing: each process
+    only knows its own tasks (task_status) and files (file_store). Shared
+    backends override every method. Other stores plug in by subclassing it and
+    assigning an instance to state_backend before the app serves requests.
+    """
+
+    shared = False
+    # How long the status of a job that has not finished is kept without updates.
+    ACTIVE_TTL = 24 * 3600
+
+    def put_task(self, task_id, status, ttl):
+        """Saves a task's status dict, to be forgotten `ttl` seconds from now."""
+
+    def get_task(self, task_id):
+        """Returns a task's status dict, or None if it is unknown or expired."""
         return None
 
+    def delete_task(self, task_id):
+        pass
 
-# The task that will run in a separate thread.
-def scrape_task(task_id, url, output_format, tag, filter_keyword, depth):
+    def claim_task(self, task_id, status, ttl):
+        """
+        Saves `status` as a fresh start of the task, dropping any cancel request,
+        unless it is queued or in progress already. Returns whether it was saved;
+        done as one step, so two workers never both start the same task.
+        """
+        return True
+
+    def request_cancel(self, task_id):
+        """Records that the task should stop, for the worker running it to pick up."""
+
+    def cancel_requests(self, task_ids):
+        """Returns the set of `task_ids` whose cancellation was requested."""
+        return set()
+
+    def put_artifact(self, file_id, file_info, ttl):
+        """Saves the metadata of a stored file: its 'path', 'mimetype' and 'filename'."""
+
+    def get_artifact(self, file_id):
+        """Returns the metadata saved by put_artifact, or None."""
+        return None
+
+    def delete_artifact(self, file_id):
+        pass
+
+
+class SQLiteStateBackend(StateBackend):
     """
-    Performs the web scraping in a background thread using an iterative approach.
+    State backend in a SQLite file, shared by every process that opens the same
+    path. Entries carry an expiry time and expired ones are purged now and then.
     """
-    global task_status, file_store, file_store_lock
 
-    # Initialize task status with progress tracking
-    task_status[task_id] = {
-        "status": "in_progress",
-        "progress": {
-            "percentage": 0,
-            "message": "Initializing...",
-            "pages_processed": 0,
-            "total_items": 0
-        }
-    }
+    shared = True
+    PURGE_INTERVAL = 60
 
-    scraped_data = []
-    visited_urls = set()
-    url_queue = deque([(url, 0)])  # (url, current_depth)
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._purged_at = 0
 
-    try:
-        while url_queue:
-            current_url, current_depth = url_queue.popleft()
+    def _connection(self):
+        # Opened on first use so importing the module never touches the disk.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    file_id TEXT PRIMARY KEY,
+                    info TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
 
-            # Avoid re-visiting URLs or exceeding depth limit
-            if current_url in visited_urls or current_depth > int(depth):
-                continue
+    def _write(self, sql, params=()):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(sql, params)
+            now = time.time()
+            if now - self._purged_at > self.PURGE_INTERVAL:
+                self._purged_at = now
+                conn.execute("DELETE FROM tasks WHERE expires_at < ?", (now,))
+                conn.execute("DELETE FROM artifacts WHERE expires_at < ?", (now,))
+            conn.commit()
 
-            visited_urls.add(current_url)
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
 
-            # Update progress status
-            task_status[task_id]["progress"]["pages_processed"] = len(visited_urls)
-            task_status[task_id]["progress"]["message"] = f"Scraping page {len(visited_urls)}..."
+    def put_task(self, task_id, status, ttl):
+        self._write(
+            "INSERT INTO tasks (task_id, status, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (task_id) DO UPDATE SET status = excluded.status, expires_at = excluded.expires_at",
+            (task_id, json.dumps(status), time.time() + ttl))
 
-            # Estimate progress percentage based on total expected visits (initial URL + new links)
-            # Note: This is a simple heuristic and might not be perfectly accurate.
-            estimated_total_pages = len(visited_urls) + len(url_queue)
-            if estimated_total_pages > 0:
-                percentage = int((len(visited_urls) / (estimated_total_pages)) * 100)
-                task_status[task_id]["progress"]["percentage"] = percentage
-            else:
-                task_status[task_id]["progress"]["percentage"] = 0
+    def get_task(self, task_id):
+        rows = self._read("SELECT status FROM tasks WHERE task_id = ? AND expires_at >= ?", (task_id, time.time()))
+        return json.loads(rows[0][0]) if rows else None
 
-            try:
-                response = requests.get(current_url, timeout=10)
-                response.raise_for_status()
-                soup = BeautifulSoup(response.text, 'html.parser')
-
-                tags_found = soup.find_all(tag)
-
-                for element in tags_found:
-                    text = element.get_text(strip=True)
-                    attribute = ''
-
-                    if element.name == 'a' and element.get('href'):
-                        attribute = urljoin(current_url, element.get('href'))
-                        if attribute.startswith('http') and attribute not in visited_urls:
-                            url_queue.append((attribute, current_depth + 1))
-                    elif element.name == 'img' and element.get('src'):
-                        attribute = urljoin(current_url, element.get('src'))
-                    else:
-                        attribute = text
-
-                    if filter_keyword and filter_keyword not in (text + ' ' + attribute).lower():
-                        continue
+    def delete_task(self, task_id):
+        self._write("DELETE FROM tasks WHERE task_id = ?", (task_id,))
 
-                    scraped_data.append({
-                        'Source URL': current_url,
-                        'Tag': element.name,
-                        'Text': text,
-                        'Attribute': attribute
-                    })
+    def claim_task(self, task_id, status, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO tasks (task_id, status, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (task_id) DO UPDATE SET status = excluded.status, cancel_requested = 0, "
+                "expires_at = excluded.expires_at "
+                "WHERE tasks.expires_at < ? OR json_extract(tasks.status, '$.status') NOT IN ('queued', 'in_progress')",
+                (task_id, json.dumps(status), now + ttl, now))
+            conn.commit()
+            return cursor.rowcount == 1
 
-            except requests.exceptions.HTTPError as e:
-                scraped_data.append({
-                    'Source URL': current_url,
-                    'Tag': 'Error',
-                    'Text': f'HTTP Error: {e.response.status_code}',
-                    'Attribute': f'Could not access URL. Check URL or network.'
-                })
-            except requests.exceptions.RequestException as e:
-                scraped_data.append({
-                    'Source URL': current_url,
-                    'Tag': 'Error',
-                    'Text': f'Connection Error',
-                    'Attribute': str(e)
-                })
-            except Exception as e:
-                scraped_data.append({
-                    'Source URL': current_url,
-                    'Tag': 'Error',
-                    'Text': 'Unexpected Error',
-                    'Attribute': str(e)
-                })
+    def request_cancel(self, task_id):
+        self._write("UPDATE tasks SET cancel_requested = 1 WHERE task_id = ?", (task_id,))
 
-            task_status[task_id]["progress"]["total_items"] = len(scraped_data)
+    def cancel_requests(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return set()
+        rows = self._read(f"SELECT task_id FROM tasks WHERE cancel_requested = 1 "
+                          f"AND task_id IN ({', '.join('?' * len(task_ids))})", task_ids)
+        return {row[0] for row in rows}
 
-        if not scraped_data:
-            task_status[task_id] = {"status": "failed", "error": "No data found or scraping failed."}
-            return
+    def put_artifact(self, file_id, file_info, ttl):
+        self._write("INSERT OR REPLACE INTO artifacts (file_id, info, expires_at) VALUES (?, ?, ?)",
+                    (file_id, json.dumps(file_info), time.time() + ttl))
 
-        df = pd.DataFrame(scraped_data)
+    def get_artifact(self, file_id):
+        rows = self._read("SELECT info FROM artifacts WHERE file_id = ? AND expires_at >= ?", (file_id, time.time()))
+        return json.loads(rows[0][0]) if rows else None
 
-        file_info = create_file_object(df, output_format)
-        if file_info is None:
-            task_status[task_id] = {"status": "failed", "error": "Failed to create file."}
-            return
+    def delete_artifact(self, file_id):
+        self._write("DELETE FROM artifacts WHERE file_id = ?", (file_id,))
 
-        file_id = str(uuid.uuid4())
-        with file_store_lock:
-            file_store[file_id] = file_info
 
-        task_status[task_id] = {
-            "status": "completed",
-            "file_id": file_id,
-            "filename": file_info['filename'],
-            "summary": {
-                "total_items": len(scraped_data)
-            }
-        }
+class RedisStateBackend(StateBackend):
+    """
+    State backend on a Redis server, shared by workers on any host. Entries are
+    JSON strings under `prefix` that Redis expires by itself. Needs the redis
+    package (pip install redis).
+    """
 
-    except Exception as e:
-        task_status[task_id] = {"status": "failed", "error": f"An unexpected error occurred: {e}"}
+    shared = True
 
+    def __init__(self, url, prefix='dataflow:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
 
-# The API endpoint for scraping links from a URL. It now starts a background task.
-@app.route('/start-scrape', methods=['POST'])
-def start_scrape():
-    data = request.json
-    url = data.get('url')
-    output_format = data.get('format')
-    tag = data.get('tag', 'a').split(',')
-    filter_keyword = data.get('filter_keyword', '')
-    depth = data.get('depth', '0')
+    def _key(self, kind, key):
+        return f'{self.prefix}{kind}:{key}'
 
-    if not url:
-        return "URL is required.", 400
+    def put_task(self, task_id, status, ttl):
+        self._redis.set(self._key('task', task_id), json.dumps(status), ex=max(int(ttl), 1))
 
-    if not output_format:
-        return "Output format is required.", 400
+    def get_task(self, task_id):
+        value = self._redis.get(self._key('task', task_id))
+        return json.loads(value) if value is not None else None
 
-    task_id = str(uuid.uuid4())
-    thread = threading.Thread(target=scrape_task, args=(task_id, url, output_format, tag, filter_keyword, depth))
-    thread.start()
+    def delete_task(self, task_id):
+        self._redis.delete(self._key('task', task_id), self._key('cancel', task_id))
 
-    return jsonify({"status": "processing", "task_id": task_id}), 202  # 202 Accepted status
+    # Run by Redis as one step: KEYS are the task and cancel keys, ARGV the status and TTL.
+    CLAIM_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        if current then
+            local state = cjson.decode(current)['status']
+            if state == 'queued' or state == 'in_progress' then
+                return 0
+            end
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        redis.call('DEL', KEYS[2])
+        return 1
+    """
 
+    def claim_task(self, task_id, status, ttl):
+        return bool(self._redis.eval(self.CLAIM_SCRIPT, 2, self._key('task', task_id), self._key('cancel', task_id),
+                                     json.dumps(status), max(int(ttl), 1)))
 
-# The API endpoint for converting an uploaded CSV file
-@app.route('/convert', methods=['POST'])
-def convert_file():
-    if 'file' not in request.files:
-        return "No file part in the request.", 400
+    def request_cancel(self, task_id):
+        self._redis.set(self._key('cancel', task_id), 1, ex=self.ACTIVE_TTL)
 
-    file = request.files['file']
-    output_format = request.form.get('format')
+    def cancel_requests(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return set()
+        values = self._redis.mget([self._key('cancel', task_id) for task_id in task_ids])
+        return {task_id for task_id, value in zip(task_ids, values) if value is not None}
 
-    if file.filename == '':
-        return "No selected file.", 400
+    def put_artifact(self, file_id, file_info, ttl):
+        self._redis.set(self._key('artifact', file_id), json.dumps(file_info), ex=max(int(ttl), 1))
 
-    if file and file.filename.endswith('.csv'):
-        try:
-            df = pd.read_csv(io.StringIO(file.stream.read().decode("utf-8")))
-            file_info = create_file_object(df, output_format)
-            if file_info is None:
-                return "Failed to create file.", 500
+    def get_artifact(self, file_id):
+        value = self._redis.get(self._key('artifact', file_id))
+        return json.loads(value) if value is not None else None
 
-            file_id = str(uuid.uuid4())
-            with file_store_lock:
-                file_store[file_id] = file_info
+    def delete_artifact(self, file_id):
+        self._redis.delete(self._key('artifact', file_id))
 
-            return jsonify({
-                "status": "success",
-                "file_id": file_id,
-                "filename": file_info['filename']
-            })
-        except Exception as e:
-            return f"Error processing the CSV file: {e}", 400
-    else:
-        return "File is not a valid CSV.", 400
 
+# Creates the state backend named by a STATE_BACKEND setting.
+def open_state_backend(url):
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateBackend(url)
+    if url not in ('', 'memory'):
+        print(f"Unknown STATE_BACKEND '{url}', keeping task state in memory.")
+    return StateBackend()
 
-# New API endpoint to check the status of a long-running task
-@app.route('/status/<task_id>', methods=['GET'])
-def get_status(task_id):
-    if task_id not in task_status:
-        return jsonify({"status": "not_found"}), 404
 
-    return jsonify(task_status[task_id])
+state_backend = open_state_backend(STATE_BACKEND)
 
 
-# New API endpoint to serve the generated file
-@app.route('/download/<file_id>', methods=['GET'])
-def download_file(file_id):
-    with file_store_lock:
-        file_info = file_store.get(file_id)
+class FileStore:
+    """
+    Byte-budgeted store for generated files, keyed by file id.
 
-    if not file_info:
-        return "File not found.", 404
+    Behaves like the plain dict it replaces: entries are the file_info dicts
+    returned by create_file_object. Large or least recently used entries are
+    moved to temp files and re-exposed as read-only mmaps, so the file_obj of
+    an entry is either a BytesIO or an mmap.mmap. With a shared state_backend
+    every entry is kept on disk and its metadata is saved in the backend, so
+    other workers can serve the file too.
+    """
 
-    # Sanitize the filename to prevent directory traversal
-    filename = sanitize_filename(file_info['filename'])
+    def __init__(self, lock, max_memory_bytes=FILE_STORE_MAX_MEMORY_BYTES,
+                 max_disk_bytes=FILE_STORE_MAX_DISK_BYTES, spill_bytes=FILE_STORE_SPILL_BYTES,
+                 ttl=FILE_STORE_TTL, spill_dir=FILE_STORE_DIR):
+        self.lock = lock
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.spill_bytes = spill_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
 
-    # Create a shallow copy of the BytesIO/StringIO object to prevent closing the original
-    if isinstance(file_info['file_obj'], io.BytesIO):
-        file_info['file_obj'].seek(0)
-        data_stream = io.BytesIO(file_info['file_obj'].read())
-    else:
-        file_info['file_obj'].seek(0)
-        data_stream = io.StringIO(file_info['file_obj'].read())
-
-    return send_file(
-        data_stream,
-        mimetype=file_info['mimetype'],
-        as_attachment=True,
-        download_name=filename
-    )
+        # file_id -> record, least recently used first.
+        self._entries = OrderedDict()
+        self.bytes_resident = 0
+        self.bytes_on_disk = 0
+        self.spills = 0
+        self.evictions = 0
+        # Spilled files that could not be removed yet (still mapped on Windows).
+        self._pending_removal = []
+
+    def _spill(self, file_info):
+        """Writes an in-memory artifact to a temp file and returns a file_info backed by its mmap."""
+        fd, path = tempfile.mkstemp(prefix='dataflow-', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb+') as handle:
+            handle.write(artifact_buffer(file_info['file_obj']))
+            handle.flush()
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return dict(file_info, file_obj=mapped, path=path), path
+
+    def _adopt(self, file_info):
+        """Takes ownership of an artifact the caller already wrote to a temp file."""
+        path = file_info['path']
+        size = os.path.getsize(path)
+        if size > 0 and (size >= self.spill_bytes or state_backend.shared):
+            with open(path, 'rb') as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            return dict(file_info, file_obj=mapped), path
+
+        # Small enough to keep in memory like any other artifact.
+        with open(path, 'rb') as handle:
+            file_obj = io.BytesIO(handle.read())
+        self._remove_file(path)
+        file_info = dict(file_info, file_obj=file_obj)
+        del file_info['path']
+        return file_info, None
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            self._pending_removal.append(path)
+
+    def _drop(self, file_id):
+        record = self._entries.pop(file_id)
+        if record["path"] is None:
+            self.bytes_resident -= record["size"]
+        else:
+            self.bytes_on_disk -= record["size"]
+            # Downloads in flight keep their own reference to the mmap, so the
+            # mapping is left for the garbage collector and only the file goes.
+            self._remove_file(record["path"])
+            if state_backend.shared:
+                try:
+                    state_backend.delete_artifact(file_id)
+                except Exception as e:
+                    print(f"Error removing file {file_id} from the state backend: {e}")
+
+    def _enforce_limits(self):
+        now = time.time()
+        for file_id in [k for k, r in self._entries.items() if now - r["created_at"] > self.ttl]:
+            self._drop(file_id)
+            self.evictions += 1
+
+        if self.bytes_resident > self.max_memory_bytes:
+            for file_id, record in list(self._entries.items()):
+                if self.bytes_resident <= self.max_memory_bytes:
+                    break
+                if record["path"] is None and record["size"] > 0:
+                    record["file_info"], record["path"] = self._spill(record["file_info"])
+                    self.bytes_resident -= record["size"]
+                    self.bytes_on_disk += record["size"]
+                    self.spills += 1
+
+        for file_id, record in list(self._entries.items()):
+            if self.bytes_on_disk <= self.max_disk_bytes:
+                break
+            if record["path"] is not None:
+                self._drop(file_id)
+                self.evictions += 1
+
+        for path in self._pending_removal[:]:
+            self._pending_removal.remove(path)
+            self._remove_file(path)
+
+    def __setitem__(self, file_id, file_info):
+        path = None
+        if file_info.get('file_obj') is None:
+            # Written straight to disk by write_streaming_file.
+            file_info, path = self._adopt(file_info)
+        size = len(artifact_buffer(file_info['file_obj']))
+        # Large artifacts, or all of them when workers share state, go straight
+        # to disk, before taking the lock.
+        if path is None and size > 0 and (size >= self.spill_bytes or state_backend.shared):
+            file_info, path = self._spill(file_info)
+
+        with self.lock:
+            if file_id in self._entries:
+                self._drop(file_id)
+            self._entries[file_id] = {
+                "file_info": file_info,
+                "size": size,
+                "path": path,
+                "created_at": time.time(),
+            }
+            if path is None:
+                self.bytes_resident += size
+            else:
+                self.bytes_on_disk += size
+                self.spills += 1
+                if state_backend.shared:
+                    # Saved before limits are enforced, so an entry dropped
+                    # right away is also removed from the backend again.
+                    try:
+                        state_backend.put_artifact(file_id, {
+                            "path": path,
+                            "mimetype": file_info['mimetype'],
+                            "filename": file_info['filename'],
+                        }, self.ttl)
+                    except Exception as e:
+                        print(f"Error saving file {file_id} to the state backend: {e}")
+            self._enforce_limits()
+
+    def get(self, file_id, default=None):
+        with self.lock:
+            record = self._entries.get(file_id)
+            if record is None:
+                return default
+            if time.time() - record["created_at"] > self.ttl:
+                self._drop(file_id)
+                self.evictions += 1
+                return default
+            self._entries.move_to_end(file_id)
+            return record["file_info"]
+
+    def __getitem__(self, file_id):
+        file_info = self.get(file_id)
+        if file_info is None:
+            raise KeyError(file_id)
+        return file_info
+
+    def __contains__(self, file_id):
+        return self.get(file_id) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def pop(self, file_id, default=None):
+        with self.lock:
+            record = self._entries.get(file_id)
+            if record is None:
+                return default
+            self._drop(file_id)
+            return record["file_info"]
+
+    def clear(self):
+        with self.lock:
+            for file_id in list(self._entries):
+                self._drop(file_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self._entries),
+                "bytes_resident": self.bytes_resident,
+                "bytes_on_disk": self.bytes_on_disk,
+                "max_memory_bytes": self.max_memory_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "spills": self.spills,
+                "evictions": self.evictions,
+            }
+
+
+file_store = FileStore(file_store_lock)
+atexit.register(file_store.clear)
+
+
+# Copies an uploaded file to a temp file in blocks, hashing it on the way.
+def spool_upload(stream, block_size=1024 * 1024):
+    """
+    Returns (temp file path, hex digest, size in bytes) of a binary stream.
+    The caller owns the temp file and must remove it.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    size = 0
+    fd, path = tempfile.mkstemp(prefix='dataflow-upload-', dir=FILE_STORE_DIR)
+    with os.fdopen(fd, 'wb') as spooled:
+        for block in iter(lambda: stream.read(block_size), b''):
+            digest.update(block)
+            spooled.write(block)
+            size += len(block)
+    return path, digest.hexdigest(), size
+
+
+class ConversionCache:
+    """
+    Content-addressed cache for /convert.
+
+    Results map (upload digest, options) to a file id already in file_store, so
+    a repeat conversion returns the existing artifact. Parsed DataFrames map an
+    upload digest to a temp file holding the pickled frame, bounded by their
+    size on disk, so the same upload converted to another format is loaded by a
+    render worker instead of being parsed again. Both are LRU.
+    """
+
+    def __init__(self, max_results=CONVERT_CACHE_MAX_RESULTS, max_frame_bytes=CONVERT_CACHE_MAX_FRAME_BYTES):
+        self.max_results = max_results
+        self.max_frame_bytes = max_frame_bytes
+        self._results = OrderedDict()
+        self._frames = OrderedDict()
+        self.frame_bytes = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        self.frame_hits = 0
+        self.frame_misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def result_key(digest, output_format, **options):
+        return (digest, output_format) + tuple(sorted(options.items()))
+
+    def get_result(self, key):
+        """Returns the cached (file_id, filename), or None if unknown or evicted from file_store."""
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result[0] not in file_store:
+                del self._results[key]
+                result = None
+            if result is None:
+                self.result_misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.result_hits += 1
+            return result
+
+    def put_result(self, key, file_id, filename):
+        with self._lock:
+            self._results[key] = (file_id, filename)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def get_frame(self, digest):
+        """Returns the path of the pickled frame for an upload, or None."""
+        with self._lock:
+            entry = self._frames.get(digest)
+            if entry is None:
+                self.frame_misses += 1
+                return None
+            self._frames.move_to_end(digest)
+            self.frame_hits += 1
+            return entry[0]
+
+    def put_frame(self, digest, path):
+        """Takes ownership of a pickled frame file; it is removed when evicted."""
+        nbytes = os.path.getsize(path)
+        if nbytes > self.max_frame_bytes:
+            os.remove(path)
+            return
+        with self._lock:
+            if digest in self._frames:
+                self._drop_frame(digest)
+            self._frames[digest] = (path, nbytes)
+            self.frame_bytes += nbytes
+            while self.frame_bytes > self.max_frame_bytes:
+                self._drop_frame(next(iter(self._frames)))
+
+    def _drop_frame(self, digest):
+        # A render worker may still be reading the file; on POSIX it keeps its
+        # open handle, and the job falls back to the upload if it is too late.
+        path, nbytes = self._frames.pop(digest)
+        self.frame_bytes -= nbytes
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            while self._frames:
+                self._drop_frame(next(iter(self._frames)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "results": len(self._results),
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "frames": len(self._frames),
+                "frame_bytes": self.frame_bytes,
+                "frame_hits": self.frame_hits,
+                "frame_misses": self.frame_misses,
+            }
+
+
+conversion_cache = ConversionCache()
+atexit.register(conversion_cache.clear)
+
+
+class Metrics:
+    """
+    Process-wide counters and histograms, rendered in the Prometheus text
+    format. Metrics are declared once and can be updated from any thread.
+    """
+
+    def __init__(self):
+        self._declared = {}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def declare(self, name, kind, help_text, buckets=METRICS_BUCKETS):
+        self._declared[name] = (kind, help_text, tuple(buckets))
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        # Bucket counts are kept per bucket and only made cumulative in render.
+        buckets = self._declared[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(buckets) + 1) + [0.0]
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self, gauges=()):
+        """
+        Returns every metric as Prometheus text. `gauges` are current values
+        computed by the caller, as (name, help, [(labels dict, value), ...]).
+        """
+        with self._lock:
+            series = {key: list(value) if isinstance(value, list) else value
+                      for key, value in self._series.items()}
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._declared.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (series_name, pairs), value in sorted(series.items()):
+                if series_name != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(pairs)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._labels(pairs + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(pairs)} {value[-1]}')
+                lines.append(f'{name}_count{self._labels(pairs)} {cumulative}')
+
+        for name, help_text, values in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values:
+                lines.append(f'{name}{self._labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.declare('dataflow_stage_seconds', 'histogram',
+                'Time spent per processing stage: fetch (DNS, connect and waiting for the headers), '
+                'download, parse, extract, spool (reading an upload), render and checkpoint.')
+metrics.declare('dataflow_request_seconds', 'histogram', 'Time taken to build the response, per route.')
+metrics.declare('dataflow_queue_wait_seconds', 'histogram', 'Time jobs waited for a worker, per queue.')
+metrics.declare('dataflow_task_pages', 'histogram', 'Pages processed per scrape task.',
+                buckets=(1, 10, 100, 1000, 10000, 100000))
+metrics.declare('dataflow_fetched_bytes_total', 'counter', 'Bytes of page bodies downloaded.')
+metrics.declare('dataflow_pages_total', 'counter', 'Pages scraped, by where the page came from.')
+metrics.declare('dataflow_page_errors_total', 'counter', 'Pages that could not be scraped, by error kind.')
+metrics.declare('dataflow_pages_skipped_total', 'counter', 'Links not followed and response bodies not read, by reason.')
+metrics.declare('dataflow_tasks_total', 'counter', 'Finished jobs, by queue and final status.')
+
+
+class TaskProfiler:
+    """
+    Opt-in cProfile and tracemalloc profile of one task.
+
+    Work done for the task on any thread goes through `run`, which profiles it
+    with a cProfile profiler of that thread's own; `finish` merges them into a
+    text report. Python 3.12+ allows only one active cProfile profiler per
+    process, so there calls made while another is active run unprofiled and
+    are counted in the report. tracemalloc traces the whole process, so memory
+    is only recorded when no other task is tracing it already.
+    """
+
+    _tracing_lock = threading.Lock()
+
+    def __init__(self, top=PROFILE_TOP):
+        self.top = top
+        self._profiles = {}
+        self._sections = []
+        self._tracing = False
+        self._unprofiled = 0
+        self._active = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with TaskProfiler._tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+
+    def run(self, fn, *args, **kwargs):
+        # Calls nested in one already being profiled on this thread run as is.
+        if getattr(self._active, 'depth', 0):
+            return fn(*args, **kwargs)
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            profile = self._profiles.get(thread_id) or cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+).
+            with self._lock:
+                self._unprofiled += 1
+            return fn(*args, **kwargs)
+        with self._lock:
+            # Only profiles that ran are kept; pstats rejects empty ones.
+            self._profiles[thread_id] = profile
+        self._active.depth = 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._active.depth = 0
+
+    def add_section(self, title, text):
+        self._sections.append((title, text))
+
+    def finish(self):
+        """Stops tracing memory and returns the report as text."""
+        output = io.StringIO()
+        with self._lock:
+            profiles = list(self._profiles.values())
+        output.write(f"cProfile, {len(profiles)} thread(s), by cumulative time\n")
+        if profiles:
+            stats = pstats.Stats(profiles[0], stream=output)
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.sort_stats('cumulative').print_stats(self.top)
+        if self._unprofiled:
+            output.write(f"{self._unprofiled} call(s) ran unprofiled while another profiler was active.\n")
+
+        if self._tracing:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            with TaskProfiler._tracing_lock:
+                tracemalloc.stop()
+            output.write(f"tracemalloc: peak {peak} bytes, {current} bytes still allocated at the end, by line\n")
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                output.write(f"{stat}\n")
+        else:
+            output.write("tracemalloc: another task was already tracing memory, so none was recorded.\n")
+
+        for title, text in self._sections:
+            output.write(f"\n{title}\n{text}")
+        return output.getvalue()
+
+
+# The main route for the web page
+@app.route('/')
+def index():
+    return render_template_string(HTML_TEMPLATE, output_formats=OUTPUT_FORMATS)
+
+
+# Writes DataFrame chunks to an XLSX workbook without building it in memory.
+def write_xlsx(chunks, output):
+    """
+    Writes an iterable of DataFrame chunks to `output` (a path or binary file)
+    using openpyxl's write-only mode, which streams each row to disk as it is
+    appended. Starts a new sheet, with the header repeated, whenever a sheet
+    reaches XLSX_MAX_ROWS_PER_SHEET rows.
+    """
+    import pandas as pd
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    workbook = Workbook(write_only=True)
+    header = None
+    sheet = None
+    rows_in_sheet = 0
+
+    def new_sheet():
+        # Same header look as DataFrame.to_excel.
+        sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+        cells = []
+        for name in header:
+            cell = WriteOnlyCell(sheet, value=name)
+            cell.font = Font(bold=True)
+            cell.border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                                 top=Side(style='thin'), bottom=Side(style='thin'))
+            cell.alignment = Alignment(horizontal='center', vertical='top')
+            cells.append(cell)
+        sheet.append(cells)
+        return sheet
+
+    for chunk in chunks:
+        if header is None:
+            header = list(chunk.columns)
+        # Missing values become empty cells, as with to_excel. Rows are
+        # converted one at a time, and only in the columns that have any.
+        missing = [i for i in range(chunk.shape[1]) if chunk.iloc[:, i].hasnans]
+        for row in chunk.itertuples(index=False, name=None):
+            if missing:
+                row = list(row)
+                for i in missing:
+                    if pd.isna(row[i]):
+                        row[i] = None
+            if sheet is None or rows_in_sheet >= XLSX_MAX_ROWS_PER_SHEET:
+                sheet = new_sheet()
+                rows_in_sheet = 1
+            sheet.append(row)
+            rows_in_sheet += 1
+
+    if sheet is None:
+        header = header or []
+        new_sheet()
+    workbook.save(output)
+
+
+# Truncates a cell so it fits on one line of its PDF column.
+def fit_pdf_cell(text, limit):
+    text = text.replace('\n', ' ')
+    return text if len(text) <= limit else text[:max(limit - 3, 1)] + '...'
+
+
+# Works out the fixed table geometry shared by every page of a PDF.
+def pdf_table_layout(df, sample_rows=1000):
+    """
+    Returns (col_widths, char_limits, rows_per_page) for drawing df on letter pages.
+    Widths are proportional to the typical text length of each column in a
+    sample of the rows, so no cell has to be measured during rendering.
+    """
+    from reportlab.lib.pagesizes import letter
+
+    page_width, page_height = letter
+    usable_width = page_width - 2 * PDF_MARGIN
+
+    sample = df.head(sample_rows).map(str)
+    weights = []
+    for i, column in enumerate(df.columns):
+        lengths = sample.iloc[:, i].str.len()
+        typical = int(lengths.quantile(0.9)) if len(lengths) else 0
+        weights.append(min(max(len(str(column)), typical, 4), 40))
+
+    total_weight = sum(weights) or 1
+    col_widths = [usable_width * weight / total_weight for weight in weights]
+    # Helvetica averages about half an em per character; leave room for padding.
+    char_limits = [max(4, int((width - 6) / (PDF_FONT_SIZE * 0.5))) for width in col_widths]
+    rows_per_page = max(1, int((page_height - 2 * PDF_MARGIN - PDF_HEADER_HEIGHT) // PDF_ROW_HEIGHT))
+    return col_widths, char_limits, rows_per_page
+
+
+# Draws a DataFrame as page-sized tables. Also the worker function for parallel rendering.
+def render_pdf_pages(df, layout):
+    """
+    Renders df onto a new PDF, one table per page with the header repeated.
+    Only one page of rows is turned into reportlab objects at a time.
+    Returns the PDF as bytes.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    from reportlab.platypus import Table, TableStyle
+
+    col_widths, char_limits, rows_per_page = layout
+    page_width, page_height = letter
+
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), PDF_FONT_SIZE),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ])
+    header = [fit_pdf_cell(str(column), limit) for column, limit in zip(df.columns, char_limits)]
+
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=letter)
+    for start in range(0, max(len(df), 1), rows_per_page):
+        page_rows = df.iloc[start:start + rows_per_page].map(str).values.tolist()
+        data = [header] + [[fit_pdf_cell(value, limit) for value, limit in zip(row, char_limits)]
+                           for row in page_rows]
+        table = Table(data, colWidths=col_widths,
+                      rowHeights=[PDF_HEADER_HEIGHT] + [PDF_ROW_HEIGHT] * len(page_rows))
+        table.setStyle(style)
+        _, height = table.wrapOn(pdf, page_width - 2 * PDF_MARGIN, page_height - 2 * PDF_MARGIN)
+        table.drawOn(pdf, PDF_MARGIN, page_height - PDF_MARGIN - height)
+        pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+
+# Process pool for CPU-heavy rendering, created on first use.
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+# Runs once in every render worker process.
+def init_render_worker():
+    # A worker already is one of the pool's processes, so it must not try to
+    # split a PDF across the pool itself.
+    global PDF_PARALLEL_WORKERS
+    PDF_PARALLEL_WORKERS = 0
+    if WARM_UP_IMPORTS:
+        warm_up()
+
+
+def get_render_pool():
+    """
+    Returns the shared rendering process pool. Workers are spawned rather than
+    forked because the parent process is running crawler and request threads.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=max(RENDER_WORKERS, PDF_PARALLEL_WORKERS, 1),
+                                               mp_context=multiprocessing.get_context('spawn'),
+                                               initializer=init_render_worker)
+        return _render_pool
+
+
+# Forgets a pool whose worker died, so the next job starts a fresh one.
+def reset_render_pool(pool):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_pdf_parallel(df, layout, workers=None):
+    """
+    Splits df into whole-page row ranges, renders each range on the process pool
+    and merges the parts in order. Raises ImportError if pypdf is not installed.
+    """
+    from pypdf import PdfWriter
+
+    workers = workers or PDF_PARALLEL_WORKERS
+    rows_per_page = layout[2]
+    pages = math.ceil(len(df) / rows_per_page)
+    part_rows = math.ceil(pages / workers) * rows_per_page
+    parts = [df.iloc[start:start + part_rows] for start in range(0, len(df), part_rows)]
+
+    writer = PdfWriter()
+    for part in get_render_pool().map(render_pdf_pages, parts, itertools.repeat(layout)):
+        writer.append(io.BytesIO(part))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+# Renders a DataFrame as a PDF, in parallel when it is large enough to be worth it.
+def create_pdf_bytes(df):
+    layout = pdf_table_layout(df)
+    if PDF_PARALLEL_WORKERS > 0 and len(df) >= PDF_PARALLEL_MIN_ROWS:
+        try:
+            return render_pdf_parallel(df, layout)
+        except ImportError:
+            print("pypdf is not installed, rendering the PDF in a single process.")
+    return render_pdf_pages(df, layout)
+
+
+# Helper function to convert a pandas DataFrame to the specified format and returns a file object
+def create_file_object(df, output_format):
+    """
+    Converts a pandas DataFrame to the specified format and returns a file-like object.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename_base = f"output_{timestamp}"
+
+    try:
+        if output_format == 'csv':
+            output = io.StringIO()
+            df.to_csv(output, index=False)
+            output.seek(0)
+            return {
+                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
+                "mimetype": 'text/csv',
+                "filename": f'{filename_base}.csv'
+            }
+
+        elif output_format == 'xlsx':
+            output = io.BytesIO()
+            write_xlsx([df], output)
+            output.seek(0)
+            return {
+                "file_obj": output,
+                "mimetype": 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                "filename": f'{filename_base}.xlsx'
+            }
+
+        elif output_format == 'pdf':
+            output = io.BytesIO(create_pdf_bytes(df))
+            output.seek(0)
+            return {
+                "file_obj": output,
+                "mimetype": 'application/pdf',
+                "filename": f'{filename_base}.pdf'
+            }
+
+        elif output_format == 'json':
+            output = io.StringIO()
+            df.to_json(output, orient='records', indent=4)
+            output.seek(0)
+            return {
+                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
+                "mimetype": 'application/json',
+                "filename": f'{filename_base}.json'
+            }
+
+        elif output_format == 'ndjson':
+            output = io.StringIO()
+            df.to_json(output, orient='records', lines=True)
+            output.seek(0)
+            return {
+                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
+                "mimetype": 'application/x-ndjson',
+                "filename": f'{filename_base}.ndjson'
+            }
+
+        elif output_format == 'html':
+            html_table = df.to_html(index=False, classes='table-auto', escape=False)
+            full_html = HTML_TABLE_PAGE.format(html_table=html_table)
+            output = io.StringIO()
+            output.write(full_html)
+            output.seek(0)
+            return {
+                "file_obj": io.BytesIO(output.getvalue().encode('utf-8')),
+                "mimetype": 'text/html',
+                "filename": f'{filename_base}.html'
+            }
+
+        elif output_format in COLUMNAR_FORMATS:
+            output = io.BytesIO()
+            if output_format == 'parquet':
+                df.to_parquet(output, index=False)
+                mimetype = 'application/vnd.apache.parquet'
+            else:
+                df.to_feather(output)
+                mimetype = 'application/vnd.apache.arrow.file'
+            output.seek(0)
+            return {
+                "file_obj": output,
+                "mimetype": mimetype,
+                "filename": f'{filename_base}.{output_format}'
+            }
+        else:
+            return None
+    except Exception as e:
+        print(f"Error during file creation: {e}")
+        return None
+
+
+class HttpSessionPool:
+    """
+    Keep-alive HTTP connections shared across all scrape jobs.
+
+    Every thread gets its own requests.Session (sessions are not thread-safe),
+    but they all mount the same HTTPAdapter, so the underlying per-host urllib3
+    connection pools and their open sockets are shared process-wide.
+    """
+
+    def __init__(self, pool_hosts=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        # Advertises every content encoding urllib3 can decode here; br and zstd
+        # are included automatically when brotli/zstandard are installed.
+        self.headers = make_headers(accept_encoding=True, user_agent=SCRAPE_USER_AGENT)
+        self._local = threading.local()
+
+    def session(self):
+        """Returns the calling thread's session, creating it on first use."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def stats(self):
+        """
+        Returns connection reuse counters for the host pools currently held.
+        A hit is a request served on an already-open connection.
+        """
+        pools = self.adapter.poolmanager.pools
+        hosts = {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "requests": pool.num_requests,
+                "hits": pool.num_requests - pool.num_connections,
+                "misses": pool.num_connections,
+            }
+        return {
+            "hosts": hosts,
+            "requests": sum(h["requests"] for h in hosts.values()),
+            "hits": sum(h["hits"] for h in hosts.values()),
+            "misses": sum(h["misses"] for h in hosts.values()),
+        }
+
+
+http_pool = HttpSessionPool()
+
+
+# Picks the BeautifulSoup parser backend, falling back to the pure-Python one.
+def resolve_html_parser(name=None):
+    """
+    Returns the BeautifulSoup parser name to use for `name` (or SCRAPE_HTML_PARSER).
+    'auto' and unavailable backends fall back to the built-in html.parser.
+    """
+    name = name or SCRAPE_HTML_PARSER
+    if name in ('auto', 'lxml'):
+        if importlib.util.find_spec('lxml') is not None:
+            return 'lxml'
+        return 'html.parser'
+    if name == 'html.parser':
+        return name
+    print(f"Unknown HTML parser '{name}', using html.parser.")
+    return 'html.parser'
+
+
+HTML_PARSER = resolve_html_parser()
+
+
+# Loads the libraries that are otherwise imported on first use.
+def warm_up():
+    """
+    Imports WARM_UP_MODULES, plus lxml when it is the HTML parser, so the first
+    conversion or scrape does not pay for them. Safe to call more than once.
+    """
+    modules = WARM_UP_MODULES + (('lxml.etree',) if HTML_PARSER == 'lxml' else ())
+    for name in modules:
+        importlib.import_module(name)
+
+
+# Writes DataFrame chunks to an open text file in one of the text formats.
+def write_text_chunks(chunks, output_format, output):
+    """
+    Handles csv, ndjson, json and html. Chunks are written as they arrive,
+    so only one chunk is ever held in memory.
+    """
+    first = True
+
+    if output_format == 'csv':
+        for chunk in chunks:
+            chunk.to_csv(output, index=False, header=first)
+            first = False
+
+    elif output_format == 'ndjson':
+        for chunk in chunks:
+            if not chunk.empty:
+                output.write(chunk.to_json(orient='records', lines=True))
+
+    elif output_format == 'json':
+        # Splice the records of every chunk into one indented array.
+        output.write('[')
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            records = chunk.to_json(orient='records', indent=4)[1:-1].strip()
+            output.write(('\n    ' if first else ',\n    ') + records)
+            first = False
+        output.write(']' if first else '\n]')
+
+    elif output_format == 'html':
+        page_head, page_tail = HTML_TABLE_PAGE.format(html_table='\0').split('\0')
+        table_tail = '  </tbody>\n</table>'
+        output.write(page_head)
+        for chunk in chunks:
+            # Floats are written one by one, as to_html would otherwise pick
+            # each chunk's precision from the values in that chunk.
+            table = chunk.to_html(index=False, classes='table-auto', escape=False, header=first, float_format=str)
+            if first:
+                # The first chunk supplies the table head; later ones only add rows.
+                output.write(table[:table.rindex(table_tail)])
+            else:
+                output.write(table[table.index('<tbody>\n') + len('<tbody>\n'):table.rindex(table_tail)])
+            first = False
+        if not first:
+            output.write(table_tail)
+        output.write(page_tail)
+
+
+# Writes DataFrame chunks straight to a temp file for the formats that can stream.
+def write_streaming_file(chunks, output_format):
+    """
+    Writes an iterable of DataFrame chunks to a temp file in a streamable format
+    (see STREAMING_FORMATS), producing the same output as create_file_object.
+    Returns a file_info dict with a 'path' instead of a 'file_obj', which the
+    FileStore takes ownership of, or None if the file could not be written.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename_base = f"output_{timestamp}"
+    mimetypes = {
+        'csv': 'text/csv',
+        'json': 'application/json',
+        'ndjson': 'application/x-ndjson',
+        'html': 'text/html',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    }
+    if output_format not in mimetypes:
+        return None
+
+    fd, path = tempfile.mkstemp(prefix='dataflow-', dir=FILE_STORE_DIR)
+    os.close(fd)
+    try:
+        if output_format == 'xlsx':
+            write_xlsx(chunks, path)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                write_text_chunks(chunks, output_format, output)
+    except RenderCancelled:
+        os.remove(path)
+        raise
+    except Exception as e:
+        print(f"Error during file creation: {e}")
+        os.remove(path)
+        return None
+
+    return {
+        "path": path,
+        "mimetype": mimetypes[output_format],
+        "filename": f'{filename_base}.{output_format}'
+    }
+
+
+# Picks the parser for uploads read whole, falling back to pandas' C parser.
+def resolve_csv_engine(name=None):
+    """
+    Returns the read_csv engine to use for `name` (or CSV_ENGINE). 'pyarrow'
+    falls back to 'c' when pyarrow is not installed.
+    """
+    name = name or CSV_ENGINE
+    if name == 'pyarrow':
+        if importlib.util.find_spec('pyarrow') is not None:
+            return 'pyarrow'
+        print("pyarrow is not installed, parsing CSV files with the C parser.")
+        return 'c'
+    if name == 'c':
+        return name
+    print(f"Unknown CSV engine '{name}', using the C parser.")
+    return 'c'
+
+
+CSV_PARSER_ENGINE = resolve_csv_engine()
+
+
+# Works out which codec an uploaded file is written in.
+def detect_encoding(path):
+    """
+    Returns CSV_ENCODING, or for 'auto' the codec the file's first
+    CSV_SNIFF_BYTES bytes point to. Falls back to latin-1, which decodes anything.
+    """
+    if CSV_ENCODING != 'auto':
+        return CSV_ENCODING
+    with open(path, 'rb') as handle:
+        sample = handle.read(CSV_SNIFF_BYTES)
+
+    # UTF-32 first: its little-endian mark starts with UTF-16's.
+    for bom, encoding in ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+                          (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                          (codecs.BOM_UTF16_BE, 'utf-16')):
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # The sample may end part-way through a character.
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=len(sample) < CSV_SNIFF_BYTES)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return 'latin-1'
+    matches = from_bytes(sample)
+    best = matches.best()
+    if best is None:
+        return 'latin-1'
+    # Short samples often fit several single-byte code pages equally well;
+    # the Western one is the likeliest of those.
+    for match in matches:
+        if (match.encoding == 'cp1252' and match.chaos == best.chaos
+                and match.coherence == best.coherence):
+            return 'cp1252'
+    return best.encoding
+
+
+# Shrinks the columns of a parsed upload without changing any value.
+def optimize_dtypes(df, category_ratio=CSV_CATEGORY_MAX_RATIO):
+    """
+    Downcasts integer columns to the smallest integer type holding their
+    values, and turns text columns with no more than `category_ratio` distinct
+    values per row into categoricals. Changes df in place and returns it.
+    """
+    import pandas as pd
+
+    rows = len(df)
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if pd.api.types.is_integer_dtype(column.dtype) and column.dtype.itemsize > 1:
+            df.isetitem(i, pd.to_numeric(column, downcast='integer'))
+        elif rows and (column.dtype == object or pd.api.types.is_string_dtype(column.dtype)):
+            if column.nunique(dropna=False) <= category_ratio * rows:
+                df.isetitem(i, column.astype('category'))
+    return df
+
+
+# Parses a whole uploaded CSV into one DataFrame.
+def read_csv_frame(source_path):
+    import pandas as pd
+    df = pd.read_csv(source_path, encoding=detect_encoding(source_path), engine=CSV_PARSER_ENGINE)
+    return optimize_dtypes(df) if CSV_OPTIMIZE_DTYPES else df
+
+
+# Works out the column types a whole-file read would give a CSV read in chunks.
+def sniff_csv_dtypes(source_path, encoding, first, chunk_rows=CONVERT_CHUNK_ROWS):
+    """
+    Returns (dtype, casts): dtype is for read_csv, and casts maps column
+    positions to a type each chunk is converted to after it is read. pandas
+    infers types chunk by chunk, so an integer column with a blank in one chunk
+    would otherwise come out as 1.0 there and 1 everywhere else. `first` is the
+    first chunk; its text columns are settled, so only the others are re-read.
+    """
+    import pandas as pd
+
+    def kind_of(column):
+        # Booleans with blanks are parsed as objects.
+        if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) == 'boolean':
+            return 'b'
+        return column.dtype.kind
+
+    positions = [i for i, (_, column) in enumerate(first.items()) if kind_of(column) in 'iufb']
+    if not positions:
+        return {}, {}
+    kinds = {i: set() for i in positions}
+    blanks = set()
+    with pd.read_csv(source_path, encoding=encoding, usecols=positions, chunksize=chunk_rows) as chunks:
+        for chunk in chunks:
+            for i, (_, column) in zip(positions, chunk.items()):
+                if column.hasnans:
+                    blanks.add(i)
+                    if column.isna().all():
+                        continue
+                kinds[i].add(kind_of(column))
+
+    dtype, casts = {}, {}
+    for i in positions:
+        name = first.columns[i]
+        if kinds[i] - set('iufb'):
+            dtype[name] = str
+        elif 'b' in kinds[i]:
+            if len(kinds[i]) > 1:
+                dtype[name] = str
+            elif i in blanks:
+                # Booleans with blanks are read whole as objects: True, False and NaN.
+                casts[i] = object
+        elif 'f' in kinds[i] or i in blanks:
+            if kinds[i] & set('iu'):
+                dtype[name] = 'float64'
+    return dtype, casts
+
+
+# Reads an uploaded CSV CONVERT_CHUNK_ROWS rows at a time, typed as if read whole.
+def iter_csv_chunks(source_path, chunk_rows=CONVERT_CHUNK_ROWS):
+    import pandas as pd
+
+    encoding = detect_encoding(source_path)
+    first = pd.read_csv(source_path, encoding=encoding, nrows=chunk_rows)
+    if len(first) < chunk_rows:
+        yield first
+        return
+    dtype, casts = sniff_csv_dtypes(source_path, encoding, first, chunk_rows)
+    with pd.read_csv(source_path, encoding=encoding, dtype=dtype or None, chunksize=chunk_rows) as chunks:
+        for chunk in chunks:
+            for i, cast in casts.items():
+                chunk.isetitem(i, chunk.iloc[:, i].astype(cast))
+            yield chunk
+
+
+# Reads the input of a render job: an uploaded CSV or a file of pickled DataFrames.
+def iter_source_frames(source_path, source_kind):
+    if source_kind == 'csv':
+        yield from iter_csv_chunks(source_path)
+        return
+
+    with open(source_path, 'rb') as source:
+        while True:
+            try:
+                yield pickle.load(source)
+            except EOFError:
+                return
+
+
+# Pickles DataFrames one after another into a temp file and returns its path.
+def write_frames_file(frames, prefix='dataflow-frames-'):
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=FILE_STORE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            for frame in frames:
+                pickle.dump(frame, output, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+class RenderCancelled(Exception):
+    """Raised by run_render when the task's cancel_event is set during a render."""
+
+
+# Yields the frames, raising RenderCancelled between them once `cancel_event` is set.
+def watch_cancel(frames, cancel_event):
+    for frame in frames:
+        if cancel_event.is_set():
+            raise RenderCancelled()
+        yield frame
+
+
+def render_job(source_path, source_kind, output_format, keep_frame=False, profile=False, cancel_event=None):
+    """
+    Renders one output file, normally inside a render worker process. The input
+    is read from `source_path` (see iter_source_frames) and the result is
+    written to a temp file, so only paths cross the process boundary.
+
+    With `keep_frame` a CSV source is parsed whole and the frame is also
+    pickled for the conversion cache. Returns {"file_info", "frame_path"};
+    file_info is None if the file could not be created. With `profile` the
+    result also has a "profile" report of the render, from a TaskProfiler.
+    A `cancel_event` (only usable in this process) is checked between chunks.
+    """
+    if profile:
+        profiler = TaskProfiler()
+        profiler.start()
+        result = profiler.run(render_job, source_path, source_kind, output_format, keep_frame)
+        result["profile"] = profiler.finish()
+        return result
+
+    import pandas as pd
+
+    frame_path = None
+    df = None
+    if source_kind == 'csv' and (keep_frame or output_format not in STREAMING_FORMATS):
+        # The whole table is needed anyway, so parse it in one go.
+        df = read_csv_frame(source_path)
+        if keep_frame:
+            frame_path = write_frames_file([df], prefix='dataflow-frame-')
+        frames = [df]
+    else:
+        frames = iter_source_frames(source_path, source_kind)
+    if cancel_event is not None:
+        frames = watch_cancel(frames, cancel_event)
+
+    if output_format in STREAMING_FORMATS:
+        try:
+            file_info = write_streaming_file(frames, output_format)
+        except RenderCancelled:
+            if frame_path is not None:
+                os.remove(frame_path)
+            raise
+        return {"file_info": file_info, "frame_path": frame_path}
+
+    if df is None:
+        df = pd.concat(frames, ignore_index=True)
+    file_info = create_file_object(df, output_format)
+    if file_info is not None:
+        fd, path = tempfile.mkstemp(prefix='dataflow-', dir=FILE_STORE_DIR)
+        with os.fdopen(fd, 'wb') as output:
+            output.write(artifact_buffer(file_info.pop('file_obj')))
+        file_info['path'] = path
+    return {"file_info": file_info, "frame_path": frame_path}
+
+
+# Runs a render job on the render pool, or in this thread with RENDER_WORKERS=0.
+# Raises RenderCancelled, leaving no files behind, once `cancel_event` is set.
+def run_render(source_path, source_kind, output_format, keep_frame=False, profile=False, cancel_event=None):
+    if RENDER_WORKERS <= 0:
+        # A profile of this thread already covers the render.
+        result = render_job(source_path, source_kind, output_format, keep_frame, cancel_event=cancel_event)
+    else:
+        pool = get_render_pool()
+        try:
+            future = pool.submit(render_job, source_path, source_kind, output_format, keep_frame, profile)
+            while cancel_event is not None and not wait([future], timeout=0.5).done:
+                if cancel_event.is_set():
+                    # A running worker can't be stopped, so its files are removed when it is done.
+                    if not future.cancel():
+                        future.add_done_callback(discard_render)
+                    raise RenderCancelled()
+            result = future.result()
+        except BrokenProcessPool:
+            reset_render_pool(pool)
+            raise
+
+    if cancel_event is not None and cancel_event.is_set():
+        discard_render(result)
+        raise RenderCancelled()
+    return result
+
+
+# Removes the files of a render that is no longer wanted; takes a result or its future.
+def discard_render(result):
+    if isinstance(result, Future):
+        if result.cancelled() or result.exception() is not None:
+            return
+        result = result.result()
+    paths = [result["frame_path"]]
+    if result["file_info"] is not None:
+        paths.append(result["file_info"]["path"])
+    for path in paths:
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+# Starts a call on the render pool, or runs it right away with RENDER_WORKERS=0.
+def submit_render(fn, *args):
+    if RENDER_WORKERS > 0:
+        return get_render_pool().submit(fn, *args)
+
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def parse_upload(upload_path, whole):
+    """
+    Parses an uploaded CSV once, in a render worker, into a temp file of pickled
+    frames that render_job can read any number of times. With `whole` it is one
+    frame, as cached by ConversionCache; otherwise chunks of CONVERT_CHUNK_ROWS.
+    Returns the file's path.
+    """
+    if whole:
+        return write_frames_file([read_csv_frame(upload_path)], prefix='dataflow-frame-')
+    return write_frames_file(iter_source_frames(upload_path, 'csv'))
+
+
+class HttpCache:
+    """
+    Persistent cache of scraped pages in a SQLite file, safe to share between
+    threads and processes.
+
+    Each URL keeps its body and validators (ETag / Last-Modified). Optionally the
+    rows and links extracted from it are stored as well, keyed by the extraction
+    settings, so an unchanged page does not even need to be parsed again.
+    Least recently used entries are evicted once bodies exceed `max_bytes`.
+    Access times are kept in memory and written in one transaction every
+    ACCESS_FLUSH_SECONDS or ACCESS_FLUSH_ROWS lookups, and before evicting, so
+    cache hits do not each wait for a commit.
+    """
+
+    ACCESS_FLUSH_SECONDS = 5
+    ACCESS_FLUSH_ROWS = 256
+
+    def __init__(self, path, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES,
+                 reuse_extraction=HTTP_CACHE_REUSE_EXTRACTION):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.reuse_extraction = reuse_extraction
+        self.total_bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.extraction_reuses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        # url -> access time not yet written, and when they were last written.
+        self._accessed = {}
+        self._accessed_flushed_at = time.monotonic()
+
+    def _connection(self):
+        # Opened on first use so importing the module never touches the disk.
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL this only gives up durability of the last commits on power loss.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    body TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    extraction_key TEXT,
+                    extraction TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self.total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, url):
+        """Returns the cached entry for url as a dict, or None."""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT etag, last_modified, fetched_at, body, extraction_key, extraction "
+                "FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[url] = time.time()
+            if (len(self._accessed) >= self.ACCESS_FLUSH_ROWS
+                    or time.monotonic() - self._accessed_flushed_at >= self.ACCESS_FLUSH_SECONDS):
+                self._flush_accessed(conn)
+                conn.commit()
+        etag, last_modified, fetched_at, body, extraction_key, extraction = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": fetched_at,
+            "body": body,
+            "extraction_key": extraction_key,
+            "extraction": extraction,
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def record(self, outcome):
+        """Bumps one of the hits/revalidated/misses/extraction_reuses counters."""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, response, body):
+        """Caches a 200 response, unless it forbids storing or could never be reused."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if 'no-store' in response.headers.get('Cache-Control', ''):
+            return
+        if not (etag or last_modified or self.ttl > 0):
+            return
+
+        size = len(body)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            previous = conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._accessed.pop(url, None)
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, etag, last_modified, fetched_at, accessed_at, body, size, extraction_key, extraction) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL)",
+                (url, etag, last_modified, now, now, body, size))
+            self.total_bytes += size - (previous[0] if previous else 0)
+            self._evict(conn)
+            conn.commit()
+
+    def refresh(self, url, response):
+        """Records a 304: the cached body is current again, possibly with new validators."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE responses SET fetched_at = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (time.time(), response.headers.get('ETag'), response.headers.get('Last-Modified'), url))
+            conn.commit()
+
+    def store_extraction(self, url, extraction_key, rows, links):
+        if not self.reuse_extraction:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE responses SET extraction_key = ?, extraction = ? WHERE url = ?",
+                         (extraction_key, json.dumps({"rows": rows, "links": links}), url))
+            conn.commit()
+
+    def cached_extraction(self, entry, extraction_key):
+        """Returns (rows, links) stored for these extraction settings, or None."""
+        if not self.reuse_extraction or entry["extraction_key"] != extraction_key or not entry["extraction"]:
+            return None
+        extraction = json.loads(entry["extraction"])
+        return extraction["rows"], extraction["links"]
+
+    def _flush_accessed(self, conn):
+        """Writes the pending access times; the caller holds the lock and commits."""
+        if self._accessed:
+            conn.executemany("UPDATE responses SET accessed_at = ? WHERE url = ?",
+                             [(accessed_at, url) for url, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+        self._accessed_flushed_at = time.monotonic()
+
+    def _evict(self, conn):
+        if self.total_bytes > self.max_bytes:
+            # Evict by up-to-date access times.
+            self._flush_accessed(conn)
+        while self.total_bytes > self.max_bytes:
+            oldest = conn.execute(
+                "SELECT url, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not oldest:
+                self.total_bytes = 0
+                break
+            for url, size in oldest:
+                conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "extraction_reuses": self.extraction_reuses,
+        }
+
+
+http_cache = HttpCache(HTTP_CACHE_PATH) if HTTP_CACHE_PATH else None
+
+
+class Throttled(Exception):
+    """
+    Raised by scrape_page when a host answers 429 or 503. `retry_after` is the
+    delay the host asked for in seconds, if any, and `rows` are the error rows
+    to report if the page is not retried.
+    """
+
+    def __init__(self, retry_after, rows):
+        super().__init__(f"throttled, retry after {retry_after}")
+        self.retry_after = retry_after
+        self.rows = rows
+
+
+# Reads a Retry-After header, given either in seconds or as an HTTP date.
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class HostThrottle:
+    """
+    Per-host rate control shared by every crawl in the process.
+
+    Each host has a concurrency limit adapted AIMD-style: up to the cap the
+    crawl asks for, it grows by one request per limit's worth of responses
+    while latency stays within `latency_factor` times the host's baseline, and
+    halves (at most once per round trip) on a 429/503 or a latency spike.
+    After a 429/503 it only grows
+    back to just below the level that was throttled, and probes past that
+    again once PROBE_INTERVAL seconds have gone by. Request starts are spaced by
+    the host's Crawl-delay, and nothing is sent while a Retry-After or backoff
+    lasts. Until a host's robots.txt has been read (when `wait_for_robots` is
+    set) only one request at a time goes to it.
+
+    Latencies are those of real responses only. A host starts at the `initial`
+    limit, and its first WARMUP_SAMPLES responses only set its baseline (their
+    median), so a single early outlier does not skew it.
+    """
+
+    MAX_HOSTS = 10000
+    PROBE_INTERVAL = 30
+    WARMUP_SAMPLES = 4
+
+    def __init__(self, initial=HOST_INITIAL_CONCURRENCY, latency_factor=HOST_LATENCY_FACTOR,
+                 max_backoff=HOST_MAX_BACKOFF, wait_for_robots=SCRAPE_RESPECT_ROBOTS):
+        self.initial = max(1, initial)
+        self.latency_factor = latency_factor
+        self.max_backoff = max_backoff
+        self.wait_for_robots = wait_for_robots
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            if len(self._hosts) >= self.MAX_HOSTS:
+                self._prune()
+            state = self._hosts[host] = {
+                "limit": float(self.initial),
+                "cap": self.initial,
+                "in_flight": 0,
+                "next_start": 0.0,
+                "crawl_delay": 0.0,
+                "robots_known": not self.wait_for_robots,
+                "latency": None,
+                "baseline": None,
+                "warmup": [],
+                "last_decrease": 0.0,
+                "ceiling": None,
+                "strikes": 0,
+                "last_used": 0.0,
+            }
+        return state
+
+    def _prune(self):
+        # Forget idle hosts; they start over from the initial limit if seen again.
+        now = time.monotonic()
+        for host, state in list(self._hosts.items()):
+            if state["in_flight"] == 0 and state["next_start"] < now and now - state["last_used"] > 600:
+                del self._hosts[host]
+
+    def acquire(self, host, cap):
+        """
+        Claims a request slot for `host`, allowing at most `cap` in flight.
+        Returns 0 when claimed, the seconds to wait before trying again when
+        the host is being delayed, or None when it has to wait for a response.
+        """
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            if now < state["next_start"]:
+                return state["next_start"] - now
+            limit = int(state["limit"]) if state["robots_known"] else 1
+            if state["in_flight"] >= max(1, min(cap, limit)):
+                return None
+            state["in_flight"] += 1
+            state["cap"] = cap
+            state["last_used"] = now
+            if state["crawl_delay"]:
+                state["next_start"] = now + state["crawl_delay"]
+            return 0
+
+    def release(self, host, latency=None, throttled=False, retry_after=None):
+        """
+        Returns a slot claimed with acquire. `latency` is how long the host took
+        to answer, left out when the visit sent no request; `throttled` marks a
+        429/503, with the Retry-After it carried.
+        """
+        with self._lock:
+            state = self._state(host)
+            state["in_flight"] = max(0, state["in_flight"] - 1)
+            now = time.monotonic()
+
+            if throttled:
+                if now - state["last_decrease"] >= (state["latency"] or 0):
+                    state["ceiling"] = state["limit"]
+                self._decrease(state, now)
+                state["strikes"] += 1
+                if retry_after is None:
+                    retry_after = 2 ** (state["strikes"] - 1)
+                state["next_start"] = max(state["next_start"], now + min(retry_after, self.max_backoff))
+                return
+            if latency is None:
+                return
+
+            state["strikes"] = 0
+            state["latency"] = latency if state["latency"] is None else 0.7 * state["latency"] + 0.3 * latency
+            # The baseline follows the fastest responses and only creeps up slowly.
+            baseline = state["baseline"]
+            if len(state["warmup"]) < self.WARMUP_SAMPLES:
+                state["warmup"].append(latency)
+                state["baseline"] = sorted(state["warmup"])[len(state["warmup"]) // 2]
+            else:
+                state["baseline"] = min(latency, baseline + (latency - baseline) * 0.01)
+            if len(state["warmup"]) == self.WARMUP_SAMPLES and state["latency"] > self.latency_factor * state["baseline"]:
+                self._decrease(state, now)
+                return
+
+            limit = min(max(state["cap"], state["limit"]), state["limit"] + 1 / state["limit"])
+            ceiling = state["ceiling"]
+            if ceiling is not None and limit >= ceiling - 1:
+                if now - state["last_decrease"] < self.PROBE_INTERVAL:
+                    limit = max(state["limit"], min(limit, ceiling - 1))
+                elif limit >= ceiling:
+                    state["ceiling"] = None
+            state["limit"] = limit
+
+    def _decrease(self, state, now):
+        if now - state["last_decrease"] < (state["latency"] or 0):
+            return
+        state["limit"] = max(1.0, state["limit"] / 2)
+        state["last_decrease"] = now
+
+    def set_crawl_delay(self, host, delay):
+        """Records a host's robots.txt Crawl-delay and lets it go beyond one request."""
+        with self._lock:
+            state = self._state(host)
+            state["crawl_delay"] = min(max(0.0, delay), self.max_backoff)
+            state["robots_known"] = True
+            if state["crawl_delay"] and state["last_used"]:
+                state["next_start"] = max(state["next_start"], state["last_used"] + state["crawl_delay"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {
+                    "limit": round(state["limit"], 2),
+                    "in_flight": state["in_flight"],
+                    "crawl_delay": state["crawl_delay"],
+                    "latency": round(state["latency"], 4) if state["latency"] is not None else None,
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+host_throttle = HostThrottle()
+
+
+class RobotsCache:
+    """
+    robots.txt rules per site, fetched on first use and kept for `ttl` seconds.
+
+    A missing robots.txt (4xx) allows everything. When it cannot be fetched
+    (5xx or a network error) the whole site counts as disallowed until the
+    entry expires, as RFC 9309 asks. Each site's Crawl-delay (or Request-rate)
+    is handed to the HostThrottle. At most ROBOTS_MAX_BYTES are read.
+    """
+
+    MAX_SITES = 10000
+    ERROR_TTL = 300
+
+    def __init__(self, throttle, user_agent=SCRAPE_USER_AGENT, ttl=ROBOTS_TTL):
+        self.throttle = throttle
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self._sites = OrderedDict()
+        self._fetch_locks = {}
+        self._lock = threading.Lock()
+
+    def allowed(self, url):
+        parts = urlsplit(url)
+        return self._rules(parts.scheme, parts.netloc).can_fetch(self.user_agent, url)
+
+    def _rules(self, scheme, host):
+        site = f"{scheme}://{host}"
+        with self._lock:
+            entry = self._sites.get(site)
+            if entry is not None and entry[1] > time.monotonic():
+                self._sites.move_to_end(site)
+                return entry[0]
+            fetch_lock = self._fetch_locks.setdefault(site, threading.Lock())
+
+        # One thread fetches; the others wait for its result.
+        with fetch_lock:
+            with self._lock:
+                entry = self._sites.get(site)
+                if entry is not None and entry[1] > time.monotonic():
+                    return entry[0]
+
+            rules, ttl = self._fetch(site)
+            delay = rules.crawl_delay(self.user_agent)
+            if delay is None:
+                rate = rules.request_rate(self.user_agent)
+                delay = rate.seconds / rate.requests if rate and rate.requests else 0
+            self.throttle.set_crawl_delay(host, float(delay))
+
+            with self._lock:
+                self._sites[site] = (rules, time.monotonic() + ttl)
+                self._sites.move_to_end(site)
+                while len(self._sites) > self.MAX_SITES:
+                    evicted, _ = self._sites.popitem(last=False)
+                    self._fetch_locks.pop(evicted, None)
+            return rules
+
+    def _fetch(self, site):
+        rules = RobotFileParser(f"{site}/robots.txt")
+        try:
+            with http_pool.session().get(f"{site}/robots.txt", timeout=10, stream=True) as response:
+                if response.status_code >= 500:
+                    rules.disallow_all = True
+                    return rules, min(self.ttl, self.ERROR_TTL)
+                if response.status_code >= 400:
+                    rules.allow_all = True
+                    return rules, self.ttl
+                body, complete = read_body(response, ROBOTS_MAX_BYTES)
+        except requests.exceptions.RequestException:
+            rules.disallow_all = True
+            return rules, min(self.ttl, self.ERROR_TTL)
+
+        if not complete:
+            # Rules past the limit are ignored, along with the line it cuts through.
+            body = body[:ROBOTS_MAX_BYTES].rpartition(b'\n')[0]
+        rules.parse(decode_body(response, body).splitlines())
+        return rules, self.ttl
+
+
+robots_cache = RobotsCache(host_throttle)
+
+
+class ExtractionSpec:
+    """
+    What a scrape pulls out of every page, compiled once per job.
+
+    Elements are chosen by tag name, or by a CSS selector (attribute selectors
+    included) that replaces the tag names when given. Each row's Attribute is
+    the named `attribute`, or by default an anchor's href, an image's src, or
+    the element's text. Filters keep an element when any of `filter_keywords`
+    (or the older single `filter_keyword`) occurs in it, ignoring case, or
+    when `filter_regex` matches it. Both are prepared once per job, and each
+    field is lowercased once however many keywords there are.
+    `filter_on` picks the fields tested: 'any', 'attribute' or 'text'. The
+    attribute is always tested before the text, so with 'attribute' rejected
+    elements never have their text extracted.
+    Raises ValueError for an invalid selector, regex or filter_on.
+    """
+
+    FILTER_FIELDS = ('any', 'attribute', 'text')
+
+    def __init__(self, tags=('a',), filter_keyword='', selector=None, attribute=None,
+                 filter_keywords=(), filter_regex=None, filter_on='any'):
+        for name, value in (('selector', selector), ('attribute', attribute), ('filter_regex', filter_regex)):
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{name} must be a string.")
+        self.tags = [tags] if isinstance(tags, str) else list(tags)
+        self.attribute = attribute or None
+        if filter_on not in self.FILTER_FIELDS:
+            raise ValueError(f"filter_on must be one of {', '.join(self.FILTER_FIELDS)}.")
+        self.filter_on = filter_on
+
+        if isinstance(filter_keywords, str):
+            filter_keywords = [filter_keywords]
+        if not all(isinstance(keyword, str) for keyword in filter_keywords):
+            raise ValueError("filter_keywords must be a list of strings.")
+        # A keyword containing a shorter one adds nothing to the filter.
+        keywords = sorted({k.lower() for k in [filter_keyword, *filter_keywords] if k}, key=lambda k: (len(k), k))
+        self.filter_keywords = [k for i, k in enumerate(keywords) if not any(shorter in k for shorter in keywords[:i])]
+        self.filter_regex = filter_regex or None
+        try:
+            self._regex = re.compile(self.filter_regex) if self.filter_regex else None
+        except re.error as e:
+            raise ValueError(f"Invalid filter_regex: {e}")
+        self.filtering = bool(self.filter_keywords or self._regex)
+
+        self.selector = selector or None
+        self._selector = None
+        if self.selector:
+            import soupsieve
+            try:
+                self._selector = soupsieve.compile(self.selector)
+            except soupsieve.SelectorSyntaxError as e:
+                raise ValueError(f"Invalid selector: {e}")
+
+    @property
+    def key(self):
+        """Identifies the settings, so cached extractions are only reused for the same ones."""
+        return json.dumps([sorted(self.tags), self.selector, self.attribute, self.filter_keywords,
+                           self.filter_regex, self.filter_on])
+
+    def matches(self, value):
+        """Returns whether a field passes the keyword and regex filters."""
+        if self.filter_keywords:
+            lowered = value.lower()
+            # Plain substring tests beat a regex alternation at any realistic number of keywords.
+            if any(keyword in lowered for keyword in self.filter_keywords):
+                return True
+        return self._regex is not None and self._regex.search(value) is not None
+
+    def select(self, soup):
+        """Returns the elements the CSS selector picks from a parsed page."""
+        return self._selector.select(soup)
+
+    def attribute_of(self, element, base_url):
+        """Returns the element's Attribute, or None when that is its text."""
+        if self.attribute is not None:
+            value = element.get(self.attribute, '')
+            if isinstance(value, list):
+                value = ' '.join(value)
+            if value and self.attribute in ('href', 'src'):
+                value = urljoin(base_url, value)
+            return value
+        if element.name == 'a' and element.get('href'):
+            return urljoin(base_url, element.get('href'))
+        if element.name == 'img' and element.get('src'):
+            return urljoin(base_url, element.get('src'))
+        return None
+
+    def row(self, element, base_url):
+        """Returns the element's row, or None when the filter rejects it."""
+        attribute = self.attribute_of(element, base_url)
+        text = None
+        if self.filtering:
+            if attribute is not None and self.filter_on != 'text' and self.matches(attribute):
+                pass
+            elif attribute is not None and self.filter_on == 'attribute':
+                return None
+            else:
+                text = element.get_text(strip=True)
+                if not self.matches(text):
+                    return None
+        if text is None:
+            text = element.get_text(strip=True)
+        return {
+            'Source URL': base_url,
+            'Tag': element.name,
+            'Text': text,
+            'Attribute': text if attribute is None else attribute
+        }
+
+
+# Pulls the requested elements, and the links to follow, out of one page of HTML.
+def extract_elements(html, current_url, spec, follow_links):
+    """
+    Parses `html` and returns (rows, links) for an ExtractionSpec.
+    Anchors are always parsed when `follow_links` is set, even if they are not
+    part of the spec's tags, so deeper levels can be crawled whatever is being
+    extracted. A CSS selector needs the whole page to be parsed.
+    """
+    rows = []
+    links = []
+    tags = spec.tags
+    if spec.selector is not None:
+        wanted = ['a'] if follow_links else []
+    else:
+        wanted = tags + ['a'] if follow_links and 'a' not in tags else tags
+
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    started = time.perf_counter()
+    parse_only = SoupStrainer(wanted) if SCRAPE_PARSE_ONLY and spec.selector is None else None
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+    parsed = time.perf_counter()
+
+    tags_found = soup.find_all(wanted) if wanted else []
+
+    for element in tags_found:
+        if element.name == 'a' and follow_links and element.get('href'):
+            link = urljoin(current_url, element.get('href'))
+            if link.startswith('http'):
+                links.append(link)
+
+        # Anchors parsed only for link-following are not part of the result.
+        if spec.selector is not None or element.name not in tags:
+            continue
+
+        row = spec.row(element, current_url)
+        if row is not None:
+            rows.append(row)
+
+    if spec.selector is not None:
+        for element in spec.select(soup):
+            row = spec.row(element, current_url)
+            if row is not None:
+                rows.append(row)
+
+    metrics.observe('dataflow_stage_seconds', parsed - started, stage='parse')
+    metrics.observe('dataflow_stage_seconds', time.perf_counter() - parsed, stage='extract')
+    return rows, links
+
+
+# Decides from a response's headers alone whether its body is worth reading.
+def unwanted_response(response, html_types=SCRAPE_HTML_TYPES, max_bytes=SCRAPE_MAX_PAGE_BYTES):
+    """
+    Returns 'content_type' when the response is not HTML, 'too_large' when its
+    Content-Length is over `max_bytes`, or None. A missing header passes.
+    """
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type and content_type not in html_types:
+        return 'content_type'
+    try:
+        if int(response.headers.get('Content-Length', '')) > max_bytes:
+            return 'too_large'
+    except ValueError:
+        pass
+    return None
+
+
+# Reads a streamed response body, giving up once it grows past `max_bytes`.
+def read_body(response, max_bytes=SCRAPE_MAX_PAGE_BYTES):
+    """
+    Returns (body, complete). The limit applies to the decompressed body, so a
+    small compressed response cannot expand into an unbounded one.
+    """
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        body += chunk
+        if len(body) > max_bytes:
+            return bytes(body), False
+    return bytes(body), True
+
+
+# Decodes a body read with read_body the way requests' Response.text would.
+def decode_body(response, body):
+    encoding = response.encoding or requests.compat.chardet.detect(body)['encoding'] or 'utf-8'
+    try:
+        return str(body, encoding, errors='replace')
+    except LookupError:
+        return str(body, 'utf-8', errors='replace')
+
+
+# How long the host took to answer the page scrape_page last fetched on this
+# thread (response.elapsed), or None when the visit sent no request.
+page_fetch = threading.local()
+
+
+# Fetches a single page and extracts the requested elements from it.
+def scrape_page(current_url, spec, follow_links=True, cache=None, robots=None):
+    """
+    Downloads one page and extracts what `spec` (an ExtractionSpec, or tag
+    names to take whole) asks for. Runs on a crawl worker
+    thread, so it only returns data and never touches shared state.
+    When `cache` (an HttpCache) is given, fresh entries are used without a
+    request and stale ones are revalidated; unchanged pages reuse the rows
+    extracted last time if they were extracted with the same settings.
+    With `robots` (a RobotsCache) pages the site disallows are not fetched.
+    Responses that are not HTML give no rows, and pages over
+    SCRAPE_MAX_PAGE_BYTES stop downloading and give an error row.
+    Returns a tuple of (rows, links) where links are absolute http(s) URLs,
+    or raises Throttled when the host answers 429 or 503.
+    """
+    if not isinstance(spec, ExtractionSpec):
+        spec = ExtractionSpec(spec)
+    extraction_key = json.dumps([spec.key, follow_links])
+    page_fetch.latency = None
+
+    try:
+        if robots is not None and not robots.allowed(current_url):
+            metrics.inc('dataflow_page_errors_total', kind='robots')
+            return [{
+                'Source URL': current_url,
+                'Tag': 'Error',
+                'Text': 'Blocked by robots.txt',
+                'Attribute': 'The site does not allow this page to be crawled.'
+            }], []
+
+        entry = cache.lookup(current_url) if cache is not None else None
+
+        if entry is not None and cache.is_fresh(entry):
+            cache.record('hits')
+            metrics.inc('dataflow_pages_total', source='cache')
+            html = entry["body"]
+        else:
+            headers = cache.conditional_headers(entry) if entry is not None else None
+            started = time.perf_counter()
+            # Streamed, so the body is only downloaded once the headers say it is wanted.
+            with http_pool.session().get(current_url, headers=headers, timeout=10, stream=True) as response:
+                # `elapsed` runs until the headers were parsed; the rest is the body.
+                waited = page_fetch.latency = response.elapsed.total_seconds()
+                metrics.observe('dataflow_stage_seconds', waited, stage='fetch')
+                if response.status_code in (429, 503):
+                    metrics.inc('dataflow_page_errors_total', kind='throttled')
+                    raise Throttled(parse_retry_after(response.headers.get('Retry-After')), [{
+                        'Source URL': current_url,
+                        'Tag': 'Error',
+                        'Text': f'HTTP Error: {response.status_code}',
+                        'Attribute': 'The site kept asking to slow down.'
+                    }])
+                if entry is not None and response.status_code == 304:
+                    cache.record('revalidated')
+                    metrics.inc('dataflow_pages_total', source='not_modified')
+                    cache.refresh(current_url, response)
+                    html = entry["body"]
+                else:
+                    response.raise_for_status()
+                    unwanted = unwanted_response(response)
+                    if unwanted is None:
+                        body, complete = read_body(response)
+                        metrics.inc('dataflow_fetched_bytes_total', len(body))
+                        metrics.observe('dataflow_stage_seconds',
+                                        max(0.0, time.perf_counter() - started - waited), stage='download')
+                        if not complete:
+                            unwanted = 'too_large'
+                    if unwanted == 'content_type':
+                        metrics.inc('dataflow_pages_skipped_total', reason='content_type')
+                        return [], []
+                    if unwanted == 'too_large':
+                        metrics.inc('dataflow_page_errors_total', kind='too_large')
+                        return [{
+                            'Source URL': current_url,
+                            'Tag': 'Error',
+                            'Text': 'Page too large',
+                            'Attribute': f'The page is larger than {SCRAPE_MAX_PAGE_BYTES} bytes.'
+                        }], []
+                    metrics.inc('dataflow_pages_total', source='network')
+                    html = decode_body(response, body)
+                    if cache is not None:
+                        cache.record('misses')
+                        cache.store(current_url, response, html)
+                        entry = None
+
+        if entry is not None:
+            extraction = cache.cached_extraction(entry, extraction_key)
+            if extraction is not None:
+                cache.record('extraction_reuses')
+                return extraction
+
+        rows, links = extract_elements(html, current_url, spec, follow_links)
+        if cache is not None:
+            cache.store_extraction(current_url, extraction_key, rows, links)
+        return rows, links
+
+    except Throttled:
+        raise
+    except requests.exceptions.HTTPError as e:
+        metrics.inc('dataflow_page_errors_total', kind='http')
+        return [{
+            'Source URL': current_url,
+            'Tag': 'Error',
+            'Text': f'HTTP Error: {e.response.status_code}',
+            'Attribute': f'Could not access URL. Check URL or network.'
+        }], []
+    except requests.exceptions.RequestException as e:
+        metrics.inc('dataflow_page_errors_total', kind='connection')
+        return [{
+            'Source URL': current_url,
+            'Tag': 'Error',
+            'Text': f'Connection Error',
+            'Attribute': str(e)
+        }], []
+    except Exception as e:
+        metrics.inc('dataflow_page_errors_total', kind='other')
+        return [{
+            'Source URL': current_url,
+            'Tag': 'Error',
+            'Text': 'Unexpected Error',
+            'Attribute': str(e)
+        }], []
+
+
+# Normalizes a URL so different spellings of the same page compare equal.
+def canonicalize_url(url):
+    """
+    Lowercases the scheme and host, drops default ports and the fragment,
+    sorts the query parameters and gives an empty path a '/'. Query parameters
+    are sorted as raw 'key=value' pairs so their encoding is left untouched.
+    """
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return url
+
+    if ':' in host:
+        host = f'[{host}]'
+    netloc = host
+    if port is not None and (scheme, port) not in (('http', 80), ('https', 443)):
+        netloc = f'{host}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+
+    query = '&'.join(sorted(pair for pair in parts.query.split('&') if pair))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+class DigestSeenSet:
+    """
+    Seen-set that keeps a fixed-width 8-byte BLAKE2b digest per URL rather than
+    the URL itself. Collisions are possible but vanishingly rare.
+    """
+
+    def __init__(self):
+        self._digests = set()
+
+    @staticmethod
+    def _digest(url):
+        return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def add(self, url):
+        self._digests.add(self._digest(url))
+
+    def __contains__(self, url):
+        return self._digest(url) in self._digests
+
+    def __len__(self):
+        return len(self._digests)
+
+    # Checkpoints store the digests packed, 8 bytes each, not as int objects.
+    def __getstate__(self):
+        return array('Q', self._digests).tobytes()
+
+    def __setstate__(self, state):
+        digests = array('Q')
+        digests.frombytes(state)
+        self._digests = set(digests)
+
+
+class BloomSeenSet:
+    """
+    Bloom filter seen-set. Uses a fixed bit array sized for `capacity` URLs at
+    the given false positive rate; a false positive means a page is skipped.
+    """
+
+    def __init__(self, capacity=SCRAPE_BLOOM_CAPACITY, error_rate=SCRAPE_BLOOM_ERROR_RATE):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, url):
+        # Double hashing: k positions from the two halves of one 128-bit digest.
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, url):
+        for position in self._positions(url):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, url):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(url))
+
+    def __len__(self):
+        return self._count
+
+
+def make_seen_set(kind=None):
+    """Returns an empty seen-set of the given kind (see SCRAPE_SEEN_SET)."""
+    kind = kind or SCRAPE_SEEN_SET
+    if kind == 'digest':
+        return DigestSeenSet()
+    if kind == 'bloom':
+        return BloomSeenSet()
+    return set()
+
+
+class CrawlEngine:
+    """
+    Breadth-first crawler that fetches pages concurrently on a bounded thread pool.
+
+    Pages are processed one depth level at a time so a URL is always visited at
+    the shallowest depth it was found at, exactly like a sequential BFS. Within a
+    level, URLs are queued per host and dispatched round-robin so no host ever
+    has more than `per_host_concurrency` requests in flight.
+
+    Links are canonicalized and checked against `seen` when they are queued,
+    so every page is fetched and queued at most once however often it is linked.
+    Links to files with one of `skip_extensions` are not queued at all.
+
+    With a HostThrottle every request needs a slot from it, which adapts each
+    host's concurrency and spacing to the response times scrape_page leaves in
+    page_fetch; pages whose visit raises Throttled are put
+    back at the front of their host's queue up to `max_retries` times. Setting
+    `stop_event` ends the crawl without waiting for delayed hosts.
+
+    checkpoint() captures where the crawl is between two pages; an engine given
+    that as `resume` carries on from there instead of from `start_url`.
+    """
+
+    # How often to look again when every queued host is busy with other crawls.
+    IDLE_POLL = 0.1
+
+    def __init__(self, start_url, max_depth, visit,
+                 max_concurrency=SCRAPE_MAX_CONCURRENCY,
+                 per_host_concurrency=SCRAPE_PER_HOST_CONCURRENCY,
+                 seen_set=None, throttle=None, max_retries=SCRAPE_MAX_RETRIES, stop_event=None, resume=None,
+                 skip_extensions=SCRAPE_SKIP_EXTENSIONS):
+        self.start_url = canonicalize_url(start_url)
+        self.max_depth = max_depth
+        self.visit = visit
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.throttle = throttle
+        self.max_retries = max_retries
+        self.stop_event = stop_event or threading.Event()
+        self.skip_extensions = skip_extensions
+
+        # Every URL ever queued, whether fetched yet or not.
+        self.seen = make_seen_set(seen_set)
+        self.host_queues = {}
+        self.host_load = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.next_level = []
+        self.current_depth = 0
+        self.pages_processed = 0
+        # future -> (url, host, start time) of every page being fetched.
+        self.in_flight = {}
+        self._wake_at = None
+        self._resume_pending = None
+        if resume is not None:
+            self.seen = resume["seen"]
+            self.next_level = list(resume["next_level"])
+            self.current_depth = resume["current_depth"]
+            self.pages_processed = resume["pages_processed"]
+            self._resume_pending = list(resume["pending"])
+
+    def checkpoint(self):
+        """
+        Returns the crawl's progress as a picklable dict. Pages still being
+        fetched count as pending, so a resumed crawl fetches them again.
+        Only valid between two pages yielded by run(), from the same thread.
+        """
+        pending = [url for queue in self.host_queues.values() for url in queue]
+        pending.extend(url for url, _ in self.in_flight.values())
+        return {
+            "seen": self.seen,
+            "pending": pending,
+            "next_level": list(self.next_level),
+            "current_depth": self.current_depth,
+            "pages_processed": self.pages_processed,
+        }
+
+    @property
+    def queued(self):
+        """Number of URLs waiting to be fetched, including the next level."""
+        return sum(len(queue) for queue in self.host_queues.values()) + len(self.next_level)
+
+    def _enqueue(self, links):
+        for link in links:
+            url = canonicalize_url(link)
+            if url in self.seen:
+                continue
+            if self.skip_extensions and os.path.splitext(urlsplit(url).path)[1].lower() in self.skip_extensions:
+                metrics.inc('dataflow_pages_skipped_total', reason='extension')
+                continue
+            self.seen.add(url)
+            self.next_level.append(url)
+
+    def _schedule_level(self, urls):
+        for url in urls:
+            host = urlparse(url).netloc
+            self.host_queues.setdefault(host, deque()).append(url)
+
+    def _dispatch(self, executor, in_flight):
+        self._wake_at = None
+        for host in list(self.host_queues):
+            queue = self.host_queues[host]
+            while (queue and len(in_flight) < self.max_concurrency
+                   and self.host_load[host] < self.per_host_concurrency):
+                if self.throttle is not None:
+                    delay = self.throttle.acquire(host, self.per_host_concurrency)
+                    if delay is None:
+                        delay = self.IDLE_POLL
+                    if delay:
+                        wake_at = time.monotonic() + delay
+                        self._wake_at = wake_at if self._wake_at is None else min(self._wake_at, wake_at)
+                        break
+                url = queue.popleft()
+                self.host_load[host] += 1
+                future = executor.submit(self._visit, url, self.current_depth)
+                in_flight[future] = (url, host)
+            if not queue:
+                del self.host_queues[host]
+            if len(in_flight) >= self.max_concurrency:
+                break
+
+    def _visit(self, url, depth):
+        # Runs on a pool thread, so it can pick up what scrape_page left in page_fetch.
+        page_fetch.latency = None
+        rows, links = self.visit(url, depth)
+        return rows, links, page_fetch.latency
+
+    def _complete(self, future, url, host):
+        """Returns the page's rows, or None if it was queued again to be retried."""
+        self.host_load[host] -= 1
+        try:
+            rows, links, latency = future.result()
+        except Throttled as e:
+            if self.throttle is not None:
+                self.throttle.release(host, throttled=True, retry_after=e.retry_after)
+                if self.retries[url] < self.max_retries:
+                    self.retries[url] += 1
+                    self.host_queues.setdefault(host, deque()).appendleft(url)
+                    return None
+            self.retries.pop(url, None)
+            return e.rows
+        except Exception:
+            if self.throttle is not None:
+                self.throttle.release(host)
+            raise
+
+        if self.throttle is not None:
+            self.throttle.release(host, latency=latency)
+        self.retries.pop(url, None)
+        if self.current_depth < self.max_depth:
+            self._enqueue(links)
+        return rows
+
+    def run(self):
+        """
+        Runs the crawl, yielding (url, depth, rows) for every page as it finishes.
+        """
+        if self._resume_pending is None:
+            self.seen.add(self.start_url)
+            self._schedule_level([self.start_url])
+        else:
+            self._schedule_level(self._resume_pending)
+            self._resume_pending = None
+        in_flight = self.in_flight
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                    thread_name_prefix='crawl') as executor:
+                while True:
+                    self._dispatch(executor, in_flight)
+
+                    while in_flight or self.host_queues:
+                        if self.stop_event.is_set():
+                            return
+                        timeout = None if self._wake_at is None else max(0.0, self._wake_at - time.monotonic())
+                        if not in_flight:
+                            # Every host with queued pages is being held back for now.
+                            self.stop_event.wait(timeout)
+                            self._dispatch(executor, in_flight)
+                            continue
+
+                        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            url, host = in_flight.pop(future)
+                            rows = self._complete(future, url, host)
+                            if rows is None:
+                                continue
+                            self.pages_processed += 1
+                            yield url, self.current_depth, rows
+                        self._dispatch(executor, in_flight)
+
+                    if self.current_depth >= self.max_depth or not self.next_level:
+                        break
+
+                    self.current_depth += 1
+                    next_level, self.next_level = self.next_level, []
+                    self._schedule_level(next_level)
+        finally:
+            # Pages abandoned mid-flight still give their throttle slots back.
+            if self.throttle is not None:
+                for future, (url, host) in in_flight.items():
+                    future.add_done_callback(lambda _, host=host: self.throttle.release(host))
+
+
+class ResultBuffer:
+    """
+    Compact, append-only store for the rows of one scrape.
+
+    Rows are kept column by column instead of as one dict each. Source URLs and
+    tag names repeat a lot, so they are interned and stored as integer codes.
+    Once RESULT_SPILL_ROWS rows are held in memory they are pickled to a temp
+    file segment, so memory stays bounded however large the crawl gets.
+    Appends and reads may happen from different threads.
+    """
+
+    COLUMNS = ['Source URL', 'Tag', 'Text', 'Attribute']
+
+    def __init__(self, spill_rows=RESULT_SPILL_ROWS, spill_dir=FILE_STORE_DIR):
+        self.spill_rows = spill_rows
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._values = []
+        # (first row, row count, path) for every spilled segment, in order.
+        self._segments = []
+        self._spilled_rows = 0
+        self._last_segment = (None, None)
+        self._reset_memory()
+
+    def _reset_memory(self):
+        self._source = array('I')
+        self._tag = array('I')
+        self._text = []
+        self._attribute = []
+
+    def _intern(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def __len__(self):
+        return self._spilled_rows + len(self._text)
+
+    def extend(self, rows):
+        """Appends the row dicts produced by scrape_page."""
+        with self._lock:
+            for row in rows:
+                self._source.append(self._intern(row['Source URL']))
+                self._tag.append(self._intern(row['Tag']))
+                self._text.append(row['Text'])
+                self._attribute.append(row['Attribute'])
+            if len(self._text) >= self.spill_rows:
+                self._spill()
+
+    def _spill(self):
+        fd, path = tempfile.mkstemp(prefix='dataflow-results-', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as handle:
+            pickle.dump((self._source, self._tag, self._text, self._attribute), handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        self._segments.append((self._spilled_rows, len(self._text), path))
+        self._spilled_rows += len(self._text)
+        self._reset_memory()
+
+    def _load_segment(self, path):
+        # Paging usually walks forward through one segment, so keep the last one.
+        cached_path, columns = self._last_segment
+        if cached_path != path:
+            with open(path, 'rb') as handle:
+                columns = pickle.load(handle)
+            self._last_segment = (path, columns)
+        return columns
+
+    def _column_parts(self, start, stop):
+        """Yields (columns, local start, local stop) covering rows start..stop."""
+        for first, count, path in self._segments:
+            if first + count > start and first < stop:
+                yield self._load_segment(path), max(start - first, 0), min(stop - first, count)
+        first = self._spilled_rows
+        if first + len(self._text) > start:
+            columns = (self._source, self._tag, self._text, self._attribute)
+            yield columns, max(start - first, 0), min(stop - first, len(self._text))
+
+    def slice(self, offset, limit):
+        """Returns up to `limit` rows starting at `offset`, as dicts."""
+        with self._lock:
+            rows = []
+            for (source, tag, text, attribute), start, stop in self._column_parts(offset, offset + limit):
+                for i in range(start, stop):
+                    rows.append({
+                        'Source URL': self._values[source[i]],
+                        'Tag': self._values[tag[i]],
+                        'Text': text[i],
+                        'Attribute': attribute[i]
+                    })
+            return rows
+
+    def iter_frames(self):
+        """Yields the rows as DataFrames, one per spilled segment plus the in-memory tail."""
+        with self._lock:
+            segments = list(self._segments)
+            tail = (self._source, self._tag, self._text, self._attribute)
+        for _, _, path in segments:
+            with open(path, 'rb') as handle:
+                yield self._frame(pickle.load(handle))
+        if tail[2] or not segments:
+            yield self._frame(tail)
+
+    def _frame(self, columns):
+        import pandas as pd
+        source, tag, text, attribute = columns
+        return pd.DataFrame({
+            'Source URL': [self._values[code] for code in source],
+            'Tag': [self._values[code] for code in tag],
+            'Text': text,
+            'Attribute': attribute
+        }, columns=self.COLUMNS)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.concat(list(self.iter_frames()), ignore_index=True)
+
+    def checkpoint(self, directory):
+        """
+        Spills the rows held in memory, links every segment not yet in
+        `directory` into it and returns the index that restore() takes.
+        """
+        with self._lock:
+            if self._text:
+                self._spill()
+            segments = []
+            for index, (first, count, path) in enumerate(self._segments):
+                name = f'results-{index}'
+                target = os.path.join(directory, name)
+                if not os.path.exists(target):
+                    link_or_copy(path, target)
+                segments.append((first, count, name))
+            return {"values": list(self._values), "segments": segments}
+
+    @classmethod
+    def restore(cls, index, directory, **kwargs):
+        """Rebuilds a buffer from a checkpoint() index, with its own links to the segments."""
+        results = cls(**kwargs)
+        results._values = list(index["values"])
+        results._codes = {value: code for code, value in enumerate(results._values)}
+        for first, count, name in index["segments"]:
+            fd, path = tempfile.mkstemp(prefix='dataflow-results-', dir=results.spill_dir)
+            os.close(fd)
+            link_or_copy(os.path.join(directory, name), path)
+            results._segments.append((first, count, path))
+            results._spilled_rows = first + count
+        return results
+
+    def close(self):
+        """Deletes the spilled segments."""
+        with self._lock:
+            for _, _, path in self._segments:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._segments = []
+            self._last_segment = (None, None)
+
+
+# Spilled result segments are temp files, so remove them when the process exits.
+@atexit.register
+def close_task_results():
+    for results in list(task_results.values()):
+        results.close()
+
+
+# Gives a file a second name, sharing its data when the filesystem allows it.
+def link_or_copy(source, target):
+    """
+    Hard-links `source` as `target`, or copies it when they are on different
+    filesystems. `target` is replaced atomically if it already exists.
+    """
+    partial = target + '.part'
+    try:
+        os.link(source, partial)
+    except OSError:
+        shutil.copyfile(source, partial)
+    os.replace(partial, target)
+
+
+# Creates a directory only its owner can use, or checks that an existing one is
+# ours and not writable by anyone else. Raises PermissionError if it is not.
+def ensure_private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.name != 'posix':
+        return
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f"{path} must be a directory owned and only writable by this user")
+
+
+class CrawlCheckpoint:
+    """
+    Saved progress of one scrape, in a directory of its own under
+    SCRAPE_CHECKPOINT_DIR, from which the crawl can be resumed.
+
+    The 'state' file is a zlib-compressed pickle of the task's options, the
+    CrawlEngine checkpoint and the ResultBuffer index, replaced atomically on
+    every save. Row segments sit next to it as links to the buffer's spilled
+    files; those never change, so each is only written once. Both directories
+    are private to the app's user (see ensure_private_dir), and checkpoints
+    are not loaded from anywhere else.
+    """
+
+    STATE_FILE = 'state'
+
+    def __init__(self, task_id, root=SCRAPE_CHECKPOINT_DIR):
+        # Task ids are UUIDs; anything else must not become a path.
+        self.root = root
+        self.directory = os.path.join(root, str(uuid.UUID(task_id)))
+
+    def save(self, options, engine, results):
+        ensure_private_dir(self.root)
+        ensure_private_dir(self.directory)
+        state = {
+            "options": options,
+            "crawl": engine.checkpoint(),
+            "results": results.checkpoint(self.directory),
+            "saved_at": time.time(),
+        }
+        path = os.path.join(self.directory, self.STATE_FILE)
+        with open(path + '.part', 'wb') as handle:
+            handle.write(zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(path + '.part', path)
+
+    def load(self):
+        """Returns the saved state, or None if there is no usable checkpoint."""
+        if not self.exists():
+            return None
+        try:
+            ensure_private_dir(self.root)
+            ensure_private_dir(self.directory)
+            with open(os.path.join(self.directory, self.STATE_FILE), 'rb') as handle:
+                return pickle.loads(zlib.decompress(handle.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+            print(f"Error reading checkpoint {self.directory}: {e}")
+            return None
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.directory, self.STATE_FILE))
+
+    def delete(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def prune(root=SCRAPE_CHECKPOINT_DIR, max_age=SCRAPE_CHECKPOINT_TTL):
+        """Removes the checkpoints that were last saved more than `max_age` seconds ago."""
+        cutoff = time.time() - max_age
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return
+        for name in names:
+            directory = os.path.join(root, name)
+            state_path = os.path.join(directory, CrawlCheckpoint.STATE_FILE)
+            try:
+                saved_at = os.path.getmtime(state_path if os.path.exists(state_path) else directory)
+            except OSError:
+                continue
+            if saved_at < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+class StatusEvents:
+    """
+    Change notifications for task_status. Every change to a task bumps its
+    version and wakes whoever is waiting on that task, so progress streams
+    only do work when something actually changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._versions = {}
+
+    def _condition(self, task_id):
+        with self._lock:
+            condition = self._conditions.get(task_id)
+            if condition is None:
+                condition = self._conditions[task_id] = threading.Condition()
+            return condition
+
+    def publish(self, task_id):
+        condition = self._condition(task_id)
+        with condition:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            condition.notify_all()
+
+    def wait(self, task_id, seen_version, timeout):
+        """
+        Blocks until the task's version differs from `seen_version` or the
+        timeout passes, and returns the current version.
+        """
+        condition = self._condition(task_id)
+        with condition:
+            condition.wait_for(lambda: self._versions.get(task_id, 0) != seen_version, timeout)
+            return self._versions.get(task_id, 0)
+
+    def forget(self, task_id):
+        with self._lock:
+            self._conditions.pop(task_id, None)
+            self._versions.pop(task_id, None)
+
+
+status_events = StatusEvents()
+
+# When each running task's status was last saved to a shared state backend.
+task_saved_at = {}
+
+# Callbacks run by update_task_status when a task reaches its final status, by
+# task id. Each returns fields to add to that status (see run_profiled).
+finish_hooks = {}
+
+
+# Copies a task's status to the shared state backend, if there is one.
+def save_task_status(task_id, status):
+    if not state_backend.shared:
+        return
+    finished = status.get("status") in ("completed", "failed", "cancelled")
+    task_saved_at[task_id] = time.monotonic()
+    try:
+        state_backend.put_task(task_id, status, TASK_STATUS_TTL if finished else StateBackend.ACTIVE_TTL)
+    except Exception as e:
+        print(f"Error saving the status of task {task_id}: {e}")
+
+
+# Replaces a task's status and notifies anyone streaming its progress.
+def update_task_status(task_id, status):
+    if status.get("status") in ("completed", "failed", "cancelled"):
+        hook = finish_hooks.pop(task_id, None)
+        if hook is not None:
+            status = dict(status, **hook())
+    task_status[task_id] = status
+    save_task_status(task_id, status)
+    status_events.publish(task_id)
+
+
+# Announces a change made to a task's status in place.
+def publish_task_status(task_id, save_every=STATE_PROGRESS_INTERVAL):
+    """
+    Notifies local progress streams right away. The shared state backend gets
+    the status at most every `save_every` seconds, so per-page progress does
+    not turn into a write per page; pass 0 for changes that must be seen.
+    """
+    if state_backend.shared and time.monotonic() - task_saved_at.get(task_id, 0) >= save_every:
+        save_task_status(task_id, task_status[task_id])
+    status_events.publish(task_id)
+
+
+# Looks up a task's status here, or in the state backend when another worker runs it.
+def get_task_status(task_id):
+    status = task_status.get(task_id)
+    if status is None:
+        status = state_backend.get_task(task_id)
+    return status
+
+
+# Waits for the status of another worker's task to change, by polling the state backend.
+def poll_task_status(task_id, last_payload, timeout):
+    """
+    Returns the task's status once its JSON differs from `last_payload`, or
+    whatever it is after `timeout` seconds. None means the task is gone.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status = state_backend.get_task(task_id)
+        if status is None or json.dumps(status) != last_payload or time.monotonic() >= deadline:
+            return status
+        time.sleep(STATE_POLL_INTERVAL)
+
+
+# The task that will run in a separate thread.
+def scrape_task(task_id, url, output_format, tag, filter_keyword, depth,
+                max_concurrency=SCRAPE_MAX_CONCURRENCY,
+                per_host_concurrency=SCRAPE_PER_HOST_CONCURRENCY,
+                use_cache=True, extraction=None, resume=None, cancel_event=None, profiler=None):
+    """
+    Performs the web scraping in a background thread. Pages are fetched
+    concurrently by a CrawlEngine while this thread collects the results.
+    `extraction` holds the optional ExtractionSpec settings (selector,
+    attribute and filters) beyond `tag` and `filter_keyword`.
+    With `use_cache` pages go through the shared HttpCache, if one is configured.
+    Setting `cancel_event` stops the crawl after the pages already in flight.
+    With a TaskProfiler (see run_profiled) every page visit is profiled too.
+    The crawl is saved to a CrawlCheckpoint every SCRAPE_CHECKPOINT_INTERVAL
+    seconds; `resume` is a state loaded from one, to carry on from.
+    """
+    global task_status, file_store, file_store_lock
+
+    # Initialize task status with progress tracking
+    update_task_status(task_id, {
+        "status": "in_progress",
+        "progress": {
+            "percentage": 0,
+            "message": "Initializing..." if resume is None else "Resuming from the last checkpoint...",
+            "pages_processed": 0 if resume is None else resume["crawl"]["pages_processed"],
+            "total_items": 0
+        }
+    })
+
+    options = {
+        "url": url, "output_format": output_format, "tag": tag, "filter_keyword": filter_keyword,
+        "depth": depth, "max_concurrency": max_concurrency, "per_host_concurrency": per_host_concurrency,
+        "use_cache": use_cache, "extraction": extraction,
+    }
+    spec = ExtractionSpec(tag, filter_keyword, **(extraction or {}))
+    checkpoint = CrawlCheckpoint(task_id)
+    checkpointing = SCRAPE_CHECKPOINT_INTERVAL > 0
+    checkpointed_at = time.monotonic()
+
+    def save_checkpoint():
+        try:
+            with metrics.timer('dataflow_stage_seconds', stage='checkpoint'):
+                checkpoint.save(options, engine, scraped_data)
+        except OSError as e:
+            print(f"Error saving checkpoint of task {task_id}: {e}")
+
+    if resume is None:
+        scraped_data = ResultBuffer()
+        if checkpointing:
+            CrawlCheckpoint.prune()
+    else:
+        scraped_data = ResultBuffer.restore(resume["results"], checkpoint.directory)
+    previous = task_results.get(task_id)
+    if previous is not None:
+        previous.close()
+    task_results[task_id] = scraped_data
+
+    def visit(current_url, current_depth):
+        return scrape_page(current_url, spec, follow_links=current_depth < int(depth),
+                           cache=http_cache if use_cache else None,
+                           robots=robots_cache if SCRAPE_RESPECT_ROBOTS else None)
+
+    if profiler is not None:
+        visit = functools.partial(profiler.run, visit)
+
+    try:
+        engine = CrawlEngine(
+            url, int(depth),
+            visit,
+            max_concurrency=max_concurrency,
+            per_host_concurrency=per_host_concurrency,
+            throttle=host_throttle,
+            stop_event=cancel_event,
+            resume=resume["crawl"] if resume is not None else None
+        )
+
+        for current_url, current_depth, rows in engine.run():
+            # The page counts as done once its rows are kept, checkpoint or not.
+            scraped_data.extend(rows)
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
+            # Update progress status
+            pages_processed = engine.pages_processed
+            task_status[task_id]["progress"]["pages_processed"] = pages_processed
+            task_status[task_id]["progress"]["message"] = f"Scraped page {pages_processed}..."
+
+            # Estimate progress percentage based on pages done versus pages known so far.
+            # Note: This is a simple heuristic and might not be perfectly accurate.
+            estimated_total_pages = len(engine.seen)
+            if estimated_total_pages > 0:
+                percentage = int((pages_processed / estimated_total_pages) * 100)
+                task_status[task_id]["progress"]["percentage"] = percentage
+            else:
+                task_status[task_id]["progress"]["percentage"] = 0
+
+            task_status[task_id]["progress"]["total_items"] = len(scraped_data)
+            publish_task_status(task_id)
+
+            if checkpointing and time.monotonic() - checkpointed_at >= SCRAPE_CHECKPOINT_INTERVAL:
+                save_checkpoint()
+                checkpointed_at = time.monotonic()
+
+        metrics.observe('dataflow_task_pages', engine.pages_processed)
+        if cancel_event is not None and cancel_event.is_set():
+            # A cancelled crawl can be picked up again with /resume.
+            if checkpointing:
+                save_checkpoint()
+            update_task_status(task_id, {
+                "status": "cancelled",
+                "resumable": checkpoint.exists(),
+                "summary": {
+                    "pages_processed": engine.pages_processed,
+                    "total_items": len(scraped_data)
+                }
+            })
+            return
+
+        if not scraped_data:
+            checkpoint.delete()
+            update_task_status(task_id, {"status": "failed", "error": "No data found or scraping failed."})
+            return
+
+        # Long crawls are saved once more with nothing left to fetch, so a
+        # failed render can be retried without crawling again.
+        if checkpointing and checkpoint.exists():
+            save_checkpoint()
+
+        # The file is rendered off this process; the worker reads the results
+        # segment by segment from a temp file.
+        task_status[task_id]["progress"]["message"] = "Creating the output file..."
+        publish_task_status(task_id, save_every=0)
+        with metrics.timer('dataflow_stage_seconds', stage='render'):
+            frames_path = write_frames_file(scraped_data.iter_frames())
+            try:
+                result = run_render(frames_path, 'frames', output_format, False, profiler is not None)
+            finally:
+                os.remove(frames_path)
+        if profiler is not None and "profile" in result:
+            profiler.add_section("Render worker", result["profile"])
+        file_info = result["file_info"]
+        if file_info is None:
+            update_task_status(task_id, {"status": "failed", "error": "Failed to create file.",
+                                         "resumable": checkpoint.exists()})
+            return
+
+        file_id = str(uuid.uuid4())
+        with file_store_lock:
+            file_store[file_id] = file_info
+        checkpoint.delete()
+
+        update_task_status(task_id, {
+            "status": "completed",
+            "file_id": file_id,
+            "filename": file_info['filename'],
+            "summary": {
+                "pages_processed": engine.pages_processed,
+                "total_items": len(scraped_data)
+            }
+        })
+
+    except Exception as e:
+        update_task_status(task_id, {"status": "failed", "error": f"An unexpected error occurred: {e}",
+                                     "resumable": checkpoint.exists()})
+
+
+class JobScheduler:
+    """
+    Runs background jobs on a fixed pool of worker threads.
+
+    Jobs wait in a bounded priority queue (higher priority first, then FIFO).
+    Each job is called as `target(task_id, *args, cancel_event=event, **kwargs)`
+    and is expected to check the event and stop early once it is set. A job's
+    `cleanup` callable, if given, runs once it is done, even if it never started.
+    Finished task_status entries are evicted after `status_ttl` seconds. With a
+    shared state_backend the scheduler also polls it for cancellations of its
+    jobs requested through other workers.
+    """
+
+    SWEEP_INTERVAL = 30
+
+    def __init__(self, name='scrape', workers=JOB_WORKERS, max_queue=JOB_QUEUE_MAX, status_ttl=TASK_STATUS_TTL):
+        self.name = name
+        self.workers = max(1, workers)
+        self.status_ttl = status_ttl
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._seq = itertools.count()
+        self._cancel_events = {}
+        self._finished_at = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _ensure_workers(self):
+        # Workers start on first use so importing the module never spawns threads.
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'{self.name}-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if state_backend.shared:
+                thread = threading.Thread(target=self._watch_cancellations, name=f'{self.name}-cancel-watcher',
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, task_id, target, *args, priority=0, cleanup=None, **kwargs):
+        """
+        Queues a job. Raises queue.Full when the queue is at capacity.
+        """
+        self._ensure_workers()
+        self.evict_expired()
+
+        self._cancel_events[task_id] = threading.Event()
+        # A resumed task reuses its id, so it must not be evicted as the earlier run.
+        self._finished_at.pop(task_id, None)
+        update_task_status(task_id, {"status": "queued", "priority": priority})
+        try:
+            self._queue.put_nowait((-priority, next(self._seq), time.perf_counter(), task_id, target, args, kwargs, cleanup))
+        except queue.Full:
+            del self._cancel_events[task_id]
+            del task_status[task_id]
+            if task_saved_at.pop(task_id, None) is not None:
+                try:
+                    state_backend.delete_task(task_id)
+                except Exception as e:
+                    print(f"Error removing the status of task {task_id}: {e}")
+            raise
+
+    def cancel(self, task_id):
+        """
+        Asks a queued or running job to stop. Returns False if the job is
+        unknown or has already finished.
+        """
+        cancel_event = self._cancel_events.get(task_id)
+        if cancel_event is None:
+            return False
+
+        cancel_event.set()
+        # Jobs still in the queue are never started, so mark them right away.
+        if task_status.get(task_id, {}).get("status") == "queued":
+            update_task_status(task_id, {"status": "cancelled"})
+        return True
+
+    def evict_expired(self):
+        """Drops task statuses and results that finished more than status_ttl seconds ago."""
+        cutoff = time.time() - self.status_ttl
+        for task_id, finished_at in list(self._finished_at.items()):
+            if finished_at < cutoff:
+                self._finished_at.pop(task_id, None)
+                task_status.pop(task_id, None)
+                task_saved_at.pop(task_id, None)
+                status_events.forget(task_id)
+                results = task_results.pop(task_id, None)
+                if results is not None:
+                    results.close()
+
+    def _watch_cancellations(self):
+        # /cancel requests that reached another worker only get to this one
+        # through the state backend.
+        while True:
+            time.sleep(STATE_POLL_INTERVAL)
+            task_ids = [task_id for task_id, event in list(self._cancel_events.items()) if not event.is_set()]
+            if not task_ids:
+                continue
+            try:
+                requested = state_backend.cancel_requests(task_ids)
+            except Exception as e:
+                print(f"Error checking for cancelled tasks: {e}")
+                continue
+            for task_id in requested:
+                self.cancel(task_id)
+
+    def _worker(self):
+        while True:
+            try:
+                _, _, queued_at, task_id, target, args, kwargs, cleanup = self._queue.get(timeout=self.SWEEP_INTERVAL)
+            except queue.Empty:
+                self.evict_expired()
+                continue
+
+            metrics.observe('dataflow_queue_wait_seconds', time.perf_counter() - queued_at, queue=self.name)
+
+            cancel_event = self._cancel_events[task_id]
+            try:
+                if not cancel_event.is_set():
+                    target(task_id, *args, cancel_event=cancel_event, **kwargs)
+            except Exception as e:
+                update_task_status(task_id, {"status": "failed", "error": f"An unexpected error occurred: {e}"})
+            finally:
+                if cleanup is not None:
+                    try:
+                        cleanup()
+                    except Exception as e:
+                        print(f"Error cleaning up after task {task_id}: {e}")
+                del self._cancel_events[task_id]
+                self._finished_at[task_id] = time.time()
+                metrics.inc('dataflow_tasks_total', queue=self.name,
+                            status=task_status.get(task_id, {}).get("status", "unknown"))
+                self._queue.task_done()
+
+
+job_scheduler = JobScheduler()
+
+
+# The task that renders an uploaded CSV for /convert.
+def convert_task(task_id, upload_path, output_format, cache_key, frame_path=None, keep_frame=False,
+                 cancel_event=None, profiler=None):
+    """
+    Renders an upload spooled by /convert on the render pool, from the cached
+    parsed frame when there is one, then stores the file like a scrape result.
+    With a TaskProfiler the render worker's own profile is added to its report.
+    Setting `cancel_event` drops the render and ends the task as cancelled.
+    """
+    profile = profiler is not None
+    update_task_status(task_id, {
+        "status": "in_progress",
+        "progress": {"percentage": 0, "message": "Converting... Please wait."}
+    })
+
+    try:
+        with metrics.timer('dataflow_stage_seconds', stage='render'):
+            result = None
+            if frame_path is not None:
+                try:
+                    result = run_render(frame_path, 'frames', output_format, False, profile, cancel_event)
+                except OSError:
+                    # The cached frame was evicted in the meantime.
+                    result = None
+            if result is None:
+                result = run_render(upload_path, 'csv', output_format, keep_frame, profile, cancel_event)
+    except RenderCancelled:
+        update_task_status(task_id, {"status": "cancelled"})
+        return
+    except Exception as e:
+        update_task_status(task_id, {"status": "failed", "error": f"Error processing the CSV file: {e}"})
+        return
+
+    if result["frame_path"] is not None:
+        conversion_cache.put_frame(cache_key[0], result["frame_path"])
+    if profile and "profile" in result:
+        profiler.add_section("Render worker", result["profile"])
+
+    file_info = result["file_info"]
+    if file_info is None:
+        update_task_status(task_id, {"status": "failed", "error": "Failed to create file."})
+        return
+
+    file_id = str(uuid.uuid4())
+    with file_store_lock:
+        file_store[file_id] = file_info
+    conversion_cache.put_result(cache_key, file_id, file_info['filename'])
+
+    update_task_status(task_id, {
+        "status": "completed",
+        "file_id": file_id,
+        "filename": file_info['filename']
+    })
+
+
+# The task that converts several uploads to several formats for /convert-batch.
+def batch_convert_task(task_id, uploads, formats, cache_key, cancel_event=None):
+    """
+    Converts every upload to every format and stores the results as one ZIP.
+    Each upload is parsed once into pickled frames (or taken from the
+    conversion cache), then all of its formats are rendered from them in
+    parallel on the render pool. Conversions already in the cache are copied
+    into the archive as they are. `uploads` are dicts with the spooled "path",
+    the "name" to use in the archive, and the upload's "digest" and "size".
+    """
+    update_task_status(task_id, {
+        "status": "in_progress",
+        "progress": {"percentage": 0, "message": "Parsing uploads..."}
+    })
+
+    # Work is keyed by upload digest, so identical files are only handled once.
+    unique = {upload["digest"]: upload for upload in uploads}
+    reused = {}
+    rendered = {}
+    frames = {}
+    futures = []
+    zip_path = None
+    try:
+        for digest in unique:
+            for output_format in formats:
+                cached = conversion_cache.get_result(ConversionCache.result_key(digest, output_format))
+                file_info = file_store.get(cached[0]) if cached is not None else None
+                if file_info is not None:
+                    reused[(digest, output_format)] = file_info
+
+        # Every upload that still needs rendering is parsed exactly once, all in parallel.
+        parsing = {}
+        for digest, upload in unique.items():
+            if all((digest, output_format) in reused for output_format in formats):
+                continue
+            frame_path = conversion_cache.get_frame(digest)
+            if frame_path is not None and os.path.exists(frame_path):
+                frames[digest] = (frame_path, False, True)
+            else:
+                whole = upload["size"] <= CONVERT_CACHE_MAX_UPLOAD_BYTES
+                future = submit_render(parse_upload, upload["path"], whole)
+                futures.append(future)
+                parsing[future] = (digest, whole)
+        wait(parsing)
+        for future, (digest, whole) in parsing.items():
+            if future.exception() is None:
+                frames[digest] = (future.result(), True, whole)
+        for future, (digest, _) in parsing.items():
+            if future.exception() is not None:
+                raise ValueError(f"{unique[digest]['name']}.csv: {future.exception()}")
+
+        rendering = {}
+        for digest, (frame_path, _, _) in frames.items():
+            for output_format in formats:
+                if (digest, output_format) not in reused:
+                    future = submit_render(render_job, frame_path, 'frames', output_format)
+                    futures.append(future)
+                    rendering[future] = (digest, output_format)
+
+        pending = set(rendering)
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                update_task_status(task_id, {"status": "cancelled"})
+                return
+            for future in done:
+                digest, output_format = rendering[future]
+                file_info = future.result()["file_info"]
+                if file_info is None:
+                    raise ValueError(f"Failed to create {unique[digest]['name']}.{output_format}.")
+                rendered[(digest, output_format)] = file_info
+            finished = len(reused) + len(rendered)
+            task_status[task_id]["progress"] = {
+                "percentage": int(finished / (len(unique) * len(formats)) * 100),
+                "message": f"Created {finished} of {len(unique) * len(formats)} files..."
+            }
+            publish_task_status(task_id)
+
+        # Rendered files are copied into the archive in blocks; nothing is loaded whole.
+        fd, zip_path = tempfile.mkstemp(prefix='dataflow-', dir=FILE_STORE_DIR)
+        os.close(fd)
+        with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as archive:
+            for upload in uploads:
+                for output_format in formats:
+                    key = (upload["digest"], output_format)
+                    entry = zipfile.ZipInfo(f"{upload['name']}.{output_format}", date_time=time.localtime()[:6])
+                    entry.external_attr = 0o644 << 16
+                    entry.compress_type = (zipfile.ZIP_STORED if output_format in ZIP_STORED_FORMATS
+                                           else zipfile.ZIP_DEFLATED)
+                    with archive.open(entry, 'w', force_zip64=True) as output:
+                        if key in reused:
+                            output.write(artifact_buffer(reused[key]['file_obj']))
+                        else:
+                            with open(rendered[key]['path'], 'rb') as source:
+                                shutil.copyfileobj(source, output, 1024 * 1024)
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_info = {"path": zip_path, "mimetype": 'application/zip', "filename": f'converted_{timestamp}.zip'}
+        file_id = str(uuid.uuid4())
+        with file_store_lock:
+            file_store[file_id] = file_info
+        zip_path = None
+        conversion_cache.put_result(cache_key, file_id, file_info['filename'])
+
+        # Frames parsed whole are kept for later conversions of the same files.
+        for digest, (frame_path, owned, whole) in list(frames.items()):
+            if owned and whole:
+                conversion_cache.put_frame(digest, frame_path)
+                del frames[digest]
+
+        update_task_status(task_id, {
+            "status": "completed",
+            "file_id": file_id,
+            "filename": file_info['filename'],
+            "summary": {"files": len(uploads), "outputs": len(uploads) * len(formats), "reused": len(reused)}
+        })
+
+    except Exception as e:
+        update_task_status(task_id, {"status": "failed", "error": f"Error processing the CSV files: {e}"})
+
+    finally:
+        # Renders still running are waited for so none of their files are left behind.
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        leftovers = [zip_path] + [path for path, owned, _ in frames.values() if owned]
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                result = future.result()
+                if isinstance(result, dict) and result["file_info"] is not None:
+                    leftovers.append(result["file_info"]["path"])
+        for path in leftovers:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+# Conversions get their own job threads, one per render worker, so they never
+# wait behind long scrapes.
+render_scheduler = JobScheduler('convert', workers=RENDER_WORKERS, max_queue=RENDER_QUEUE_MAX)
+
+
+# Wraps a job for the schedulers when a profile was asked for.
+def run_profiled(task_id, target, *args, **kwargs):
+    """
+    Runs `target` as a job with a TaskProfiler passed as `profiler`. When the
+    task reaches its final status the report is stored as a text file and its
+    id is added to that status as "profile_file_id".
+    """
+    profiler = TaskProfiler()
+    profiler.start()
+
+    def store_report():
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_id = str(uuid.uuid4())
+        with file_store_lock:
+            file_store[file_id] = {
+                "file_obj": io.BytesIO(profiler.finish().encode('utf-8')),
+                "mimetype": 'text/plain',
+                "filename": f'profile_{timestamp}.txt'
+            }
+        return {"profile_file_id": file_id}
+
+    finish_hooks[task_id] = store_report
+    try:
+        profiler.run(target, task_id, *args, profiler=profiler, **kwargs)
+    finally:
+        # A target that ended without a final status still gets its report.
+        if finish_hooks.pop(task_id, None) is not None:
+            update_task_status(task_id, dict(task_status.get(task_id, {}), **store_report()))
+
+
+# The API endpoint for scraping links from a URL. It now starts a background task.
+@app.route('/start-scrape', methods=['POST'])
+def start_scrape():
+    data = request.json
+    url = data.get('url')
+    output_format = data.get('format')
+    tag = data.get('tag', 'a').split(',')
+    filter_keyword = data.get('filter_keyword', '')
+    depth = data.get('depth', '0')
+
+    if not url:
+        return "URL is required.", 400
+
+    if not output_format:
+        return "Output format is required.", 400
+
+    # Jobs may ask for less concurrency than the server allows, never more.
+    try:
+        max_concurrency = min(int(data.get('concurrency', SCRAPE_MAX_CONCURRENCY)), SCRAPE_MAX_CONCURRENCY)
+        per_host_concurrency = min(int(data.get('per_host_concurrency', SCRAPE_PER_HOST_CONCURRENCY)),
+                                   SCRAPE_PER_HOST_CONCURRENCY)
+    except (TypeError, ValueError):
+        return "Concurrency settings must be integers.", 400
+
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return "Priority must be an integer.", 400
+
+    use_cache = bool(data.get('use_cache', True))
+    job = (run_profiled, scrape_task) if data.get('profile') else (scrape_task,)
+
+    # Selector and filter options are checked here, so mistakes are reported before the job is queued.
+    extraction = {key: data[key] for key in ('selector', 'attribute', 'filter_keywords', 'filter_regex', 'filter_on')
+                  if data.get(key)}
+    try:
+        ExtractionSpec(tag, filter_keyword, **extraction)
+    except ValueError as e:
+        return str(e), 400
+
+    task_id = str(uuid.uuid4())
+    try:
+        job_scheduler.submit(task_id, *job, url, output_format, tag, filter_keyword, depth,
+                             priority=priority,
+                             max_concurrency=max_concurrency,
+                             per_host_concurrency=per_host_concurrency,
+                             use_cache=use_cache,
+                             extraction=extraction or None)
+    except queue.Full:
+        return "Too many jobs are queued, please try again later.", 429, {"Retry-After": "30"}
+
+    return jsonify({"status": "processing", "task_id": task_id}), 202  # 202 Accepted status
+
+
+# Makes /resume requests handled by this process take turns; across workers
+# the claim in the state backend does the same.
+resume_lock = threading.Lock()
+
+
+# API endpoint continuing a scrape from its last checkpoint, under the same task id
+@app.route('/resume/<task_id>', methods=['POST'])
+def resume_scrape(task_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return "Priority must be an integer.", 400
+
+    with resume_lock:
+        status = get_task_status(task_id) or {}
+        if status.get("status") in ("queued", "in_progress"):
+            return jsonify(status), 409
+
+        try:
+            state = CrawlCheckpoint(task_id).load()
+        except ValueError:
+            state = None
+        if state is None:
+            return jsonify({"status": "not_found"}), 404
+
+        # Another worker may have resumed it since; this also forgets the
+        # earlier run's cancel request.
+        try:
+            claimed = state_backend.claim_task(task_id, {"status": "queued", "priority": priority},
+                                               StateBackend.ACTIVE_TTL)
+        except Exception as e:
+            print(f"Error claiming task {task_id}: {e}")
+            return "The task could not be resumed, please try again later.", 503
+        if not claimed:
+            return jsonify(state_backend.get_task(task_id) or {}), 409
+
+        try:
+            job_scheduler.submit(task_id, scrape_task, priority=priority, resume=state, **state["options"])
+        except queue.Full:
+            return "Too many jobs are queued, please try again later.", 429, {"Retry-After": "30"}
+
+    return jsonify({"status": "processing", "task_id": task_id}), 202
+
+
+# Records how long a route takes to build its response, as dataflow_request_seconds.
+def timed_route(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with metrics.timer('dataflow_request_seconds', route=view.__name__):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+# API endpoint to stop a queued or running scrape
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    if job_scheduler.cancel(task_id) or render_scheduler.cancel(task_id):
+        return jsonify({"status": "cancelling", "task_id": task_id}), 202
+
+    status = get_task_status(task_id)
+    if status is None:
+        return jsonify({"status": "not_found"}), 404
+
+    # Another worker runs the job; it picks the request up from the backend.
+    if status.get("status") not in ("completed", "failed", "cancelled"):
+        state_backend.request_cancel(task_id)
+        return jsonify({"status": "cancelling", "task_id": task_id}), 202
+
+    # The job has already finished, so there is nothing left to cancel.
+    return jsonify(status), 409
+
+
+# The API endpoint for converting an uploaded CSV file
+@app.route('/convert', methods=['POST'])
+@timed_route
+def convert_file():
+    if 'file' not in request.files:
+        return "No file part in the request.", 400
+
+    file = request.files['file']
+    output_format = request.form.get('format')
+
+    if file.filename == '':
+        return "No selected file.", 400
+
+    if output_format not in OUTPUT_FORMATS:
+        return "Unsupported output format.", 400
+
+    if file and file.filename.endswith('.csv'):
+        with metrics.timer('dataflow_stage_seconds', stage='spool'):
+            upload_path, digest, upload_size = spool_upload(file.stream)
+
+        # The same upload converted to the same format again reuses the
+        # stored artifact right away.
+        cache_key = ConversionCache.result_key(digest, output_format)
+        cached = conversion_cache.get_result(cache_key)
+        if cached is not None:
+            os.remove(upload_path)
+            file_id, filename = cached
+            return jsonify({
+                "status": "success",
+                "file_id": file_id,
+                "filename": filename
+            })
+
+        # Anything else is rendered in the background. Small uploads are parsed
+        # whole and kept for other formats; a cached frame skips read_csv.
+        frame_path = conversion_cache.get_frame(digest)
+        job = (run_profiled, convert_task) if request.form.get('profile') in ('1', 'true', 'on') else (convert_task,)
+        task_id = str(uuid.uuid4())
+        try:
+            render_scheduler.submit(task_id, *job, upload_path, output_format, cache_key,
+                                    cleanup=functools.partial(os.remove, upload_path),
+                                    frame_path=frame_path,
+                                    keep_frame=frame_path is None and upload_size <= CONVERT_CACHE_MAX_UPLOAD_BYTES)
+        except queue.Full:
+            os.remove(upload_path)
+            return "Too many conversions are queued, please try again later.", 429, {"Retry-After": "30"}
+
+        return jsonify({"status": "processing", "task_id": task_id}), 202
+    else:
+        return "File is not a valid CSV.", 400
+
+
+# The API endpoint converting several uploaded CSV files to several formats at once
+@app.route('/convert-batch', methods=['POST'])
+@timed_route
+def convert_batch():
+    files = [file for file in request.files.getlist('files') if file.filename]
+    formats = [f for value in request.form.getlist('formats') for f in value.split(',') if f]
+    formats = list(dict.fromkeys(formats))
+
+    if not files:
+        return "No files in the request.", 400
+    if len(files) > CONVERT_BATCH_MAX_FILES:
+        return f"At most {CONVERT_BATCH_MAX_FILES} files can be converted at once.", 400
+    if not formats:
+        return "Output formats are required.", 400
+    if any(output_format not in OUTPUT_FORMATS for output_format in formats):
+        return "Unsupported output format.", 400
+    if any(not file.filename.endswith('.csv') for file in files):
+        return "File is not a valid CSV.", 400
+
+    uploads = []
+    names = set()
+    with metrics.timer('dataflow_stage_seconds', stage='spool'):
+        for file in files:
+            path, digest, size = spool_upload(file.stream)
+            # Files with the same name get a numbered suffix inside the ZIP.
+            base = sanitize_filename(file.filename)[:-len('.csv')] or 'file'
+            name, number = base, 1
+            while name in names:
+                number += 1
+                name = f"{base}_{number}"
+            names.add(name)
+            uploads.append({"path": path, "name": name, "digest": digest, "size": size})
+
+    def remove_uploads():
+        for upload in uploads:
+            os.remove(upload["path"])
+
+    cache_key = ConversionCache.result_key(
+        '+'.join(upload["digest"] for upload in uploads), 'zip',
+        formats=','.join(formats), names='/'.join(upload["name"] for upload in uploads))
+    cached = conversion_cache.get_result(cache_key)
+    if cached is not None:
+        remove_uploads()
+        file_id, filename = cached
+        return jsonify({
+            "status": "success",
+            "file_id": file_id,
+            "filename": filename
+        })
+
+    task_id = str(uuid.uuid4())
+    try:
+        render_scheduler.submit(task_id, batch_convert_task, uploads, formats, cache_key, cleanup=remove_uploads)
+    except queue.Full:
+        remove_uploads()
+        return "Too many conversions are queued, please try again later.", 429, {"Retry-After": "30"}
+
+    return jsonify({"status": "processing", "task_id": task_id}), 202
+
+
+# API endpoint streaming a task's status as Server-Sent Events whenever it changes
+@app.route('/events/<task_id>', methods=['GET'])
+def stream_status(task_id):
+    if get_task_status(task_id) is None:
+        return jsonify({"status": "not_found"}), 404
+    # Jobs run by other workers are followed through the state backend.
+    local = task_id in task_status
+
+    def generate():
+        version = -1
+        last_payload = None
+        while True:
+            if local:
+                new_version = status_events.wait(task_id, version, SSE_HEARTBEAT_SECONDS)
+                status = task_status.get(task_id)
+            else:
+                status = poll_task_status(task_id, last_payload, SSE_HEARTBEAT_SECONDS)
+                changed = status is None or json.dumps(status) != last_payload
+                new_version = version + 1 if changed else version
+            if status is None:
+                yield 'event: not_found\ndata: {"status": "not_found"}\n\n'
+                return
+            if new_version == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = new_version
+
+            payload = json.dumps(status)
+            if payload != last_payload:
+                last_payload = payload
+                yield f'data: {payload}\n\n'
+            if status.get("status") in ("completed", "failed", "cancelled"):
+                return
+            # Coalesce bursts of per-page updates into one event per interval.
+            time.sleep(SSE_MIN_INTERVAL)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# New API endpoint to check the status of a long-running task
+@app.route('/status/<task_id>', methods=['GET'])
+def get_status(task_id):
+    status = get_task_status(task_id)
+    if status is None:
+        return jsonify({"status": "not_found"}), 404
+
+    return jsonify(status)
+
+
+# API endpoint to page through the rows a scrape has extracted so far
+@app.route('/results/<task_id>', methods=['GET'])
+def get_results(task_id):
+    results = task_results.get(task_id)
+    if results is None:
+        return jsonify({"status": "not_found"}), 404
+
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 0), RESULTS_PAGE_MAX)
+    except ValueError:
+        return "offset and limit must be integers.", 400
+
+    return jsonify({
+        "task_id": task_id,
+        "status": task_status.get(task_id, {}).get("status", "unknown"),
+        "offset": offset,
+        "limit": limit,
+        "total": len(results),
+        "rows": results.slice(offset, limit)
+    })
+
+
+# API endpoint exposing keep-alive connection reuse for the scraper
+@app.route('/pool-stats', methods=['GET'])
+def pool_stats():
+    stats = http_pool.stats()
+    stats["throttle"] = host_throttle.stats()
+    return jsonify(stats)
+
+
+# API endpoint exposing memory and disk usage of the generated file store
+@app.route('/store-stats', methods=['GET'])
+def store_stats():
+    return jsonify(file_store.stats())
+
+
+# API endpoint exposing hit/miss counters of the conversion cache
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "conversion": conversion_cache.stats(),
+        "http": http_cache.stats() if http_cache is not None else None
+    })
+
+
+# Prometheus endpoint with stage latencies, counters and current queue and storage sizes
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    statuses = defaultdict(int)
+    for status in list(task_status.values()):
+        statuses[status.get("status", "unknown")] += 1
+    store = file_store.stats()
+
+    gauges = [
+        ('dataflow_queue_depth', 'Jobs waiting for a worker, per queue.',
+         [({"queue": scheduler.name}, scheduler.queue_depth) for scheduler in (job_scheduler, render_scheduler)]),
+        ('dataflow_tasks', 'Known tasks, by status.',
+         [({"status": status}, count) for status, count in sorted(statuses.items())]),
+        ('dataflow_file_store_bytes', 'Bytes of stored files, in memory and spilled to disk.',
+         [({"location": "memory"}, store["bytes_resident"]), ({"location": "disk"}, store["bytes_on_disk"])]),
+        ('dataflow_file_store_files', 'Stored files.', [({}, store["entries"])]),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+
+# New API endpoint to serve the generated file
+@app.route('/download/<file_id>', methods=['GET'])
+@timed_route
+def download_file(file_id):
+    with file_store_lock:
+        file_info = file_store.get(file_id)
+    if not file_info:
+        # Made by another worker: the backend knows where it wrote the file.
+        file_info = state_backend.get_artifact(file_id)
+
+    if not file_info:
+        return "File not found.", 404
+
+    # Sanitize the filename to prevent directory traversal
+    filename = sanitize_filename(file_info['filename'])
+
+    # Stream the stored bytes instead of copying them. Spilled artifacts are
+    # opened from disk so the server can use sendfile; in-memory ones are read
+    # chunk by chunk from a view of the buffer. Neither moves a shared position.
+    data_stream = None
+    if file_info.get('path'):
+        try:
+            data_stream = open(file_info['path'], 'rb')
+        except OSError:
+            # The file was evicted after the lookup; the mmap is still readable.
+            data_stream = None
+    if data_stream is None:
+        if file_info.get('file_obj') is None:
+            return "File not found.", 404
+        data_stream = BufferReader(artifact_buffer(file_info['file_obj']))
+    size = data_stream.seek(0, io.SEEK_END)
+    data_stream.seek(0)
+
+    response = Response(wrap_file(request.environ, data_stream), mimetype=file_info['mimetype'],
+                        direct_passthrough=True)
+    response.content_length = size
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    # Stored artifacts never change, so the file id is a strong ETag.
+    response.set_etag(file_id)
+    response.cache_control.no_cache = True
+
+    # Answers If-None-Match with 304 and Range requests with 206 partial content.
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+
+
+if WARM_UP_IMPORTS:
+    warm_up()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,420 @@
+# Benchmarks for the scraper, the file converter and the start-up time of
+# CSV_to_anything.py.
+#
+# Everything runs offline: scrapes crawl a synthetic website served from
+# 127.0.0.1, conversions render generated DataFrames, and start-up cases import
+# the app in new interpreters and answer one request. Each case runs in a fresh
+# interpreter so peak memory and CPU time belong to that case alone.
+#
+# Usage:
+#   python benchmark.py                         # all cases, results in benchmark-results.json
+#   python benchmark.py --only convert --sizes 1000,10000
+#   python benchmark.py --only startup --repeat 10
+#   python benchmark.py --output new.json --compare old.json
+#
+# Rendering happens in the benchmark process (RENDER_WORKERS=0) unless
+# --render-workers is given, so the CPU it costs is counted.
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Default synthetic site used by the scrape benchmark.
+SITE_PAGES = 500
+SITE_FANOUT = 8
+SITE_PAGE_BYTES = 8 * 1024
+SITE_LATENCY = 0.02
+SITE_ERROR_RATE = 0.01
+SITE_SEED = 1
+
+# Default DataFrame sizes for the conversion benchmark.
+CONVERT_SIZES = (1000, 10000, 100000)
+CONVERT_FORMATS = ('csv', 'xlsx', 'pdf', 'json', 'ndjson', 'html')
+
+# Libraries the app should only import on first use, and the script that
+# times one cold start: importing the app, then answering a first request.
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'reportlab', 'bs4', 'lxml')
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import CSV_to_anything
+imported = time.perf_counter()
+CSV_to_anything.app.test_client().get('/status/benchmark')
+answered = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first_request': answered - imported,
+                  'loaded': [name for name in %r if name in sys.modules]}))
+''' % (LAZY_MODULES,)
+
+# Metrics compared by --compare: rates, where higher is better, and the
+# start-up time, where lower is.
+COMPARE_METRICS = {'scrape': 'pages_per_sec', 'convert': 'rows_per_sec', 'startup': 'import_seconds'}
+
+
+class SyntheticSiteHandler(BaseHTTPRequestHandler):
+    """
+    Serves /p<n> pages of a synthetic site. Page n links to the next `fanout`
+    pages of a ring of `pages` pages, so every page is reachable from /p0, and
+    is padded with paragraphs to about `page_bytes`. Which pages fail with a 500
+    is decided by the seed, so every run sees the same errors.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        site = self.server
+        time.sleep(site.latency)
+
+        path = self.path.split('?')[0].split('#')[0]
+        try:
+            page = int(path.lstrip('/p'))
+        except ValueError:
+            self.send_error(404)
+            return
+        if not 0 <= page < site.pages:
+            self.send_error(404)
+            return
+        if random.Random(f'{site.seed}:{page}').random() < site.error_rate:
+            self.send_error(500)
+            return
+
+        links = ''.join(
+            f'<li><a href="/p{(page * site.fanout + i) % site.pages}">Page {(page * site.fanout + i) % site.pages}</a></li>'
+            for i in range(1, site.fanout + 1)
+        )
+        head = f'<!DOCTYPE html><html><head><title>Page {page}</title></head><body><h1>Page {page}</h1><ul>{links}</ul>'
+        paragraph = f'<p>Paragraph text for page {page}, padded out to make the page a realistic size.</p>'
+        padding = paragraph * max(0, (site.page_bytes - len(head)) // len(paragraph))
+        body = f'{head}{padding}</body></html>'.encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_site(conn, pages, fanout, page_bytes, latency, error_rate, seed):
+    """
+    Runs the synthetic site in its own process, so its CPU time is not counted
+    against the scraper. Sends the port over `conn` and serves until the parent
+    closes the connection.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SyntheticSiteHandler)
+    server.daemon_threads = True
+    server.pages, server.fanout, server.page_bytes = pages, fanout, page_bytes
+    server.latency, server.error_rate, server.seed = latency, error_rate, seed
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn.send(server.server_port)
+    try:
+        conn.recv()
+    except EOFError:
+        pass
+    server.shutdown()
+
+
+# Peak resident memory of this process in bytes, or None where unsupported.
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Imports the app with settings suitable for measuring it.
+def import_app(render_workers):
+    os.environ['RENDER_WORKERS'] = str(render_workers)
+    os.environ['HTTP_CACHE_PATH'] = ''
+    import CSV_to_anything
+    return CSV_to_anything
+
+
+def make_frame(rows, seed=SITE_SEED):
+    """Returns a DataFrame shaped like scrape results, the same for every run."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows)
+    return pd.DataFrame({
+        'url': [f'https://example.com/page/{i % 997}' for i in ids],
+        'tag': rng.choice(['a', 'p', 'h1', 'img'], size=rows),
+        'content': [f'Item {i} with some descriptive text' for i in ids],
+        'value': rng.normal(100, 25, size=rows).round(3),
+        'count': rng.integers(0, 10000, size=rows),
+    })
+
+
+def bench_scrape(case, render_workers):
+    """Crawls the synthetic site once with scrape_task and measures it."""
+    app = import_app(render_workers)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=serve_site,
+        args=(child_conn, case['pages'], case['fanout'], case['page_bytes'],
+              case['latency'], case['error_rate'], case['seed']),
+        daemon=True,
+    )
+    server.start()
+    port = parent_conn.recv()
+
+    try:
+        task_id = str(uuid.uuid4())
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        app.scrape_task(task_id, f'http://127.0.0.1:{port}/p0', 'csv', ['a', 'p'], '', case['depth'],
+                        max_concurrency=case['concurrency'],
+                        per_host_concurrency=case['concurrency'],
+                        use_cache=False)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    finally:
+        parent_conn.close()
+        server.join(timeout=5)
+
+    status = app.task_status[task_id]
+    if status['status'] != 'completed':
+        raise RuntimeError(f"scrape {status['status']}: {status.get('error')}")
+    pages = status['summary']['pages_processed']
+    items = status['summary']['total_items']
+    return {
+        'pages_crawled': pages,
+        'items': items,
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(cpu, 4),
+        'pages_per_sec': round(pages / wall, 2),
+        'items_per_sec': round(items / wall, 2),
+        'cpu_ms_per_page': round(cpu * 1000 / pages, 3),
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def check_chunked(app, df, output_format, chunk_rows):
+    """
+    Writes df to a CSV with a blank integer in its last row and raises
+    RuntimeError unless converting it `chunk_rows` rows at a time gives the
+    same output as converting it whole.
+    """
+    import tempfile
+    import pandas as pd
+
+    df = df.astype({'count': 'Int64'})
+    df.loc[len(df) - 1, 'count'] = pd.NA
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    outputs = []
+    try:
+        df.to_csv(path, index=False)
+        for chunks in ([pd.read_csv(path)], app.iter_csv_chunks(path, chunk_rows)):
+            file_info = app.write_streaming_file(chunks, output_format)
+            if output_format == 'xlsx':
+                # Workbooks carry their creation time, so compare the cells.
+                import openpyxl
+                with open(file_info['path'], 'rb') as handle:
+                    workbook = openpyxl.load_workbook(handle, read_only=True)
+                    outputs.append([list(row) for row in workbook.active.iter_rows(values_only=True)])
+                    workbook.close()
+            else:
+                with open(file_info['path'], 'rb') as handle:
+                    outputs.append(handle.read())
+            os.remove(file_info['path'])
+    finally:
+        os.remove(path)
+    if outputs[0] != outputs[1]:
+        raise RuntimeError(f'{output_format} converted in chunks differs from the whole-file conversion')
+
+
+def bench_convert(case, render_workers):
+    """
+    Renders one generated DataFrame with create_file_object, `repeat` times.
+    Streaming formats are first checked to give the same output in chunks.
+    """
+    app = import_app(render_workers)
+    df = make_frame(case['rows'])
+    if case['format'] in app.STREAMING_FORMATS:
+        check_chunked(app, df, case['format'], max(case['rows'] // 4, 1))
+
+    walls, cpus, size = [], [], None
+    for _ in range(case['repeat']):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        file_info = app.create_file_object(df, case['format'])
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+        if file_info is None:
+            raise RuntimeError(f"create_file_object failed for {case['format']}")
+        size = len(app.artifact_buffer(file_info['file_obj']))
+
+    wall = statistics.median(walls)
+    return {
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(statistics.median(cpus), 4),
+        'rows_per_sec': round(case['rows'] / wall, 2),
+        'output_bytes': size,
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def bench_startup(case, render_workers):
+    """Starts the app cold in a new interpreter `repeat` times and times it."""
+    env = dict(os.environ, RENDER_WORKERS=str(render_workers), HTTP_CACHE_PATH='',
+               WARM_UP_IMPORTS='1' if case['warm_up'] else '0')
+    imports, first_requests, processes, loaded = [], [], [], None
+    for _ in range(case['repeat']):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        processes.append(time.perf_counter() - started)
+        timings = json.loads(output.strip().splitlines()[-1])
+        imports.append(timings['import'])
+        first_requests.append(timings['first_request'])
+        loaded = timings['loaded']
+
+    return {
+        'import_seconds': round(statistics.median(imports), 4),
+        'first_request_seconds': round(statistics.median(first_requests), 4),
+        'process_seconds': round(statistics.median(processes), 4),
+        'lazy_modules_loaded': ','.join(loaded) or 'none',
+    }
+
+
+BENCHMARKS = {'scrape': bench_scrape, 'convert': bench_convert, 'startup': bench_startup}
+
+
+# Entry point of the per-case child process.
+def run_case(conn, kind, case, render_workers):
+    try:
+        conn.send(('ok', BENCHMARKS[kind](case, render_workers)))
+    except Exception as e:
+        conn.send(('error', f'{type(e).__name__}: {e}'))
+
+
+def run_isolated(kind, case, render_workers, timeout):
+    """Runs one case in a fresh spawned interpreter and returns its result."""
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=run_case, args=(child_conn, kind, case, render_workers))
+    process.start()
+    if not parent_conn.poll(timeout):
+        process.kill()
+        process.join()
+        return {'error': f'timed out after {timeout}s'}
+    outcome, result = parent_conn.recv()
+    process.join()
+    return result if outcome == 'ok' else {'error': result}
+
+
+# Commit the results were measured on, when run from a git checkout.
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_name(kind, case):
+    if kind == 'scrape':
+        return f"scrape pages={case['pages']} fanout={case['fanout']} concurrency={case['concurrency']}"
+    if kind == 'startup':
+        return f"startup warm_up={case['warm_up']}"
+    return f"convert {case['format']} rows={case['rows']}"
+
+
+def compare(results, baseline_path):
+    """Prints the change of each case's main metric against an earlier results file."""
+    with open(baseline_path, encoding='utf-8') as handle:
+        baseline = json.load(handle)
+    previous = {entry['name']: entry for kind in COMPARE_METRICS for entry in baseline.get(kind, [])}
+
+    print(f'\nCompared with {baseline_path}:')
+    for kind, metric in COMPARE_METRICS.items():
+        for entry in results.get(kind, []):
+            old = previous.get(entry['name'], {}).get(metric)
+            new = entry.get(metric)
+            if not old or new is None:
+                continue
+            print(f"  {entry['name']:<60} {metric} {old:>12} -> {new:>12} ({(new / old - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the scraper, the file converter '
+                                                 'and start-up time.')
+    parser.add_argument('--only', choices=sorted(BENCHMARKS), help='run only one group of benchmarks')
+    parser.add_argument('--output', default='benchmark-results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier results file to compare against')
+    parser.add_argument('--pages', type=int, default=SITE_PAGES)
+    parser.add_argument('--fanout', type=int, default=SITE_FANOUT)
+    parser.add_argument('--page-bytes', type=int, default=SITE_PAGE_BYTES)
+    parser.add_argument('--latency', type=float, default=SITE_LATENCY, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=SITE_ERROR_RATE)
+    parser.add_argument('--seed', type=int, default=SITE_SEED)
+    parser.add_argument('--concurrency', default='4,16', help='comma-separated crawl concurrencies')
+    parser.add_argument('--depth', type=int, default=20, help='maximum crawl depth')
+    parser.add_argument('--sizes', default=','.join(map(str, CONVERT_SIZES)), help='comma-separated row counts')
+    parser.add_argument('--formats', default=','.join(CONVERT_FORMATS))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='conversions or start-ups per case; the median is reported')
+    parser.add_argument('--render-workers', type=int, default=0)
+    parser.add_argument('--timeout', type=int, default=600, help='seconds allowed per case')
+    args = parser.parse_args()
+
+    cases = {'scrape': [], 'convert': [], 'startup': []}
+    for concurrency in map(int, args.concurrency.split(',')):
+        cases['scrape'].append({
+            'pages': args.pages, 'fanout': args.fanout, 'page_bytes': args.page_bytes,
+            'latency': args.latency, 'error_rate': args.error_rate, 'seed': args.seed,
+            'depth': args.depth, 'concurrency': concurrency,
+        })
+    for output_format in args.formats.split(','):
+        for rows in map(int, args.sizes.split(',')):
+            cases['convert'].append({'format': output_format, 'rows': rows, 'repeat': args.repeat})
+    for warm_up in (False, True):
+        cases['startup'].append({'warm_up': warm_up, 'repeat': args.repeat})
+
+    results = {
+        'meta': {
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'render_workers': args.render_workers,
+        },
+    }
+    for kind, kind_cases in cases.items():
+        if args.only and kind != args.only:
+            continue
+        results[kind] = []
+        for case in kind_cases:
+            name = case_name(kind, case)
+            print(f'{name} ...', end=' ', flush=True)
+            result = run_isolated(kind, case, args.render_workers, args.timeout)
+            print(result.get('error') or ', '.join(f'{key}={value}' for key, value in result.items()))
+            results[kind].append(dict(name=name, **case, **result))
+
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()